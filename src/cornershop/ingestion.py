@@ -1,17 +1,26 @@
 import builtins
 import enum
-from multiprocessing import Pool
-from typing import Any, Dict, List
+import json
+import os
+from typing import Any, Dict, List, Optional
 
 import pandas as pd
 
 from .set_up import IntegrationSetup
 from .utils import (
+    AIMDController,
     API,
     APIOps,
     CSVOps,
-    IngestItem,
-    PandasOperations
+    CSVSchema,
+    DeadLetter,
+    PandasOperations,
+    ProductSender,
+    RateLimiter,
+    RetryPolicy,
+    api_factory,
+    encode_products,
+    validate_ingest_items
 )
 
 
@@ -35,9 +44,31 @@ class CVSUsefulColNames(enum.auto):
     STOCK = 'STOCK'
 
 
+CSV_SCHEMA = CSVSchema(
+    categories=[
+        CVSUsefulColNames.BRANCH,
+        CVSUsefulColNames.BRAND,
+        CVSUsefulColNames.CATEGORY,
+        CVSUsefulColNames.SUB_CATEGORY,
+        CVSUsefulColNames.SUB_SUB_CATEGORY,
+    ],
+    integers=[CVSUsefulColNames.SKU, CVSUsefulColNames.STOCK],
+    floats=[CVSUsefulColNames.PRICE],
+    others=[
+        CVSUsefulColNames.BARCODE,
+        CVSUsefulColNames.ITEM_DESCRIPTION,
+        CVSUsefulColNames.ITEM_IMG,
+        CVSUsefulColNames.ITEM_NAME,
+    ]
+)
+""" Only the useful cols are loaded, in compact dtypes. """
+
 
 class Facade:
 
+    DOWNLOAD_CHUNKSIZE = 100_000
+    """ CSVs rows by chunk, when they are parsed while downloaded. """
+
     def __init__(
             self,
             *,
@@ -48,20 +79,65 @@ class Facade:
             url: builtins.str,
             items_batch: builtins.int = 10,
             product_branches: List[builtins.str],
-            package_units: List[builtins.str]
+            package_units: List[builtins.str],
+            csv_cache: builtins.bool = True,
+            csv_chunksize: Optional[builtins.int] = None,
+            top_n: builtins.int = 100,
+            http_timeout: builtins.float = 30.0,
+            ingest_engine: builtins.str = 'processes',
+            max_items_batch: Optional[builtins.int] = None,
+            bulk_max_items: builtins.int = 500,
+            bulk_max_bytes: builtins.int = 1_000_000,
+            retries: builtins.int = 3,
+            dead_letter: Optional[builtins.str] = None,
+            rate_limit: Optional[builtins.float] = None,
+            rate_burst: Optional[builtins.float] = None,
+            compress_payloads: builtins.bool = False,
+            download_csvs: builtins.bool = False,
+            download_segments: builtins.int = 4,
+            download_compression: Optional[builtins.str] = None
     ):
 
         self.merchant_update = merchant_to_update
         self.merchant_delete = merchant_to_delete
         self.processes = items_batch
+        self.top_n = top_n
+        self.ingest_engine = ingest_engine
+        self.max_processes = max_items_batch
+        self.bulk_max_items = bulk_max_items
+        self.bulk_max_bytes = bulk_max_bytes
+        self.compress_payloads = compress_payloads
+        self.download_csvs = download_csvs
+        self.download_segments = download_segments
+        self.download_compression = download_compression
         self.setup = IntegrationSetup()
         self.credentials = str(self.setup.PARENT_DIR.joinpath(credentials_file).resolve())
-        self.api = API(api=APIOps(self.credentials, url), logger=self.setup.LOGGER)
+        self.url = url
+        self.http_timeout = (min(5.0, http_timeout), http_timeout)
+        self.retries = retries
+        self.dead_letter = dead_letter or self.setup.dead_letter_path
+        self.rate_limiter = RateLimiter(rate_limit, burst=rate_burst) if rate_limit else None
+        self.api = API(
+            api=APIOps(
+                self.credentials,
+                url,
+                pool_size=items_batch,
+                timeout=self.http_timeout,
+                retry=RetryPolicy(retries),
+                rate_limiter=self.rate_limiter
+            ),
+            logger=self.setup.LOGGER,
+            dead_letter=DeadLetter(self.dead_letter)
+        )
         self.manipulate_csv = CSVOps(
             PandasOperations(),
             products_csv=self.setup.products_csv_path,
             price_stock_csv=self.setup.prices_stock_csv_path,
-            merchant_id=self.api.merchant_id(merchant_to_ingest_id)
+            merchant_id=self.api.merchant_id(merchant_to_ingest_id),
+            cache_dir=self.setup.csv_cache_dir if csv_cache else None,
+            # CSVs being downloaded can only be streamed.
+            chunksize=csv_chunksize or (self.DOWNLOAD_CHUNKSIZE if download_csvs else None),
+            schema=CSV_SCHEMA
         )
         self.col = CVSUsefulColNames()
         self.branches = product_branches
@@ -70,13 +146,37 @@ class Facade:
     def main(self):
 
         # ---- CSV Manipulation operations ----
-        self.setup.LOGGER.info('Filtering CSVs by branch...')
-        self._filter_csvs_by_branches(
-            self.col.BRANCH,
-            self.branches
+        if self.manipulate_csv.chunksize:
+            sources = None
+            if self.download_csvs:
+                self.setup.LOGGER.info('Downloading CSVs, they are parsed as they arrive...')
+                sources = self.setup.open_streams(
+                    segments=self.download_segments,
+                    compression=self.download_compression
+                )
+            self.setup.LOGGER.info(
+                'Streaming CSVs by chunks of '
+                f'{self.manipulate_csv.chunksize} rows, filtering by branch '
+                'and stock greater than zero...'
+            )
+            self.manipulate_csv.stream_filtered(
+                branch_column=self.col.BRANCH,
+                branches=self.branches,
+                stock_column=self.col.STOCK,
+                sku_column=self.col.SKU,
+                sources=sources
+            )
+        else:
+            self.setup.LOGGER.info('Filtering CSVs by branch...')
+            self._filter_csvs_by_branches(
+                self.col.BRANCH,
+                self.branches
+            )
+            self.setup.LOGGER.info('Filtering Prices Stock CSV by stock greater than zero...')
+            self.manipulate_csv.filter_by_stock_greater_than_zero(self.col.STOCK)
+        self.setup.LOGGER.info(
+            f'CSVs columns memory (bytes): {json.dumps(self.manipulate_csv.memory_report())}'
         )
-        self.setup.LOGGER.info('Filtering Prices Stock CSV by stock greater than zero...')
-        self.manipulate_csv.filter_by_stock_greater_than_zero(self.col.STOCK)
         # it will merge products and stocks csvs
         self.setup.LOGGER.info('Merging CSVs on SKU column, futhermore, it will drop duplicates...')
         df_without_duplicates = self._merge_dataframes_and_drop_duplicates(
@@ -91,30 +191,29 @@ class Facade:
             cols=[self.col.CATEGORY, self.col.SUB_CATEGORY, self.col.SUB_SUB_CATEGORY],
             lower_strings=True
         )
-        self.setup.LOGGER.info('Extracting package info on item description column...')
+        self.setup.LOGGER.info('Removing html tags and extracting package info on item description column...')
         df_without_duplicates[self.col.PACKAGE] = self._extract_package_info_in_description(
             df_without_duplicates,
             col_to_extract=self.col.ITEM_DESCRIPTION,
             units=self.units
         )
-        self.setup.LOGGER.info('Converting NaN value in package column to empty string...')
-        self.manipulate_csv.nan_to_empty_str(df_without_duplicates, column=self.col.PACKAGE)
         self.setup.LOGGER.info('CSV Ops is over...')
 
         # ---- Ingestion Middle Ops  ----
         self.setup.LOGGER.info('Ingestion Middle Ops has begun...')
-        self.setup.LOGGER.info('Separating branches...')
-        branches = self._separate_by_branch(df_without_duplicates)
-        mm_branch_df = branches['MM']
-        rhsm_branch_df = branches['RHSM']
-        self.setup.LOGGER.info('Getting top 100 most expensive items by branch...')
-        top_100_mm = self._top_100_most_expensive_products(mm_branch_df, self.col.PRICE)
-        top_100_rhsm = self._top_100_most_expensive_products(rhsm_branch_df, self.col.PRICE)
+        self.setup.LOGGER.info(f'Getting top {self.top_n} most expensive items of every branch...')
+        top_n = self._top_n_most_expensive_products(df_without_duplicates)
         self.setup.LOGGER.info('Validating collected items...')
-        mm_items = self._validate_items(top_100_mm)
-        rhsm_items = self._validate_items(top_100_rhsm)
-        self.setup.LOGGER.info('Comparing products\'s branches dictionaries and merging...')
-        items = self.manipulate_csv.compare_branchs(mm_items, rhsm_items, column=self.col.BRANCH)
+        items_by_branch = self._validate_items(top_n)
+        self.setup.LOGGER.info('Merging products\'s branches dictionaries...')
+        items = self.manipulate_csv.merge_branches(*items_by_branch.values(), column='branch_products')
+        # bulk requests are compressed whole instead of product by product.
+        self.setup.LOGGER.info('Serializing products...')
+        payloads = encode_products(
+            items,
+            compress=self.compress_payloads and self.ingest_engine != 'bulk'
+        )
+        del items, items_by_branch
         self.setup.LOGGER.info('Middle ops has finished...')
         # requests tasks
         self.setup.LOGGER.info('Doing requests tasks...')
@@ -131,10 +230,41 @@ class Facade:
 
         # ---- INGEST ----
         self.setup.LOGGER.info('Ingestion has been initiated...')
-        items_enumerated = [(c, i) for c, i in enumerate(items, start=1)]
-        p = Pool(processes=self.processes)
-        p.map(self.api.send_products, items_enumerated)
-        self.setup.LOGGER.info(f'All top 100 most expensive products from branches <{self.branches}> have been ingested.')
+        controller = AIMDController(
+            self.processes,
+            maximum=self.max_processes
+        ) if self.max_processes else None
+        if self.ingest_engine == 'bulk':
+            summary = self.api.send_products_bulk(
+                payloads,
+                max_items=self.bulk_max_items,
+                max_bytes=self.bulk_max_bytes,
+                compress=self.compress_payloads
+            )
+        elif self.ingest_engine == 'asyncio':
+            summary = self.api.send_products_async(
+                payloads,
+                concurrency=self.processes,
+                controller=controller
+            )
+        else:
+            with ProductSender(
+                    self.ingest_engine,
+                    controller.maximum if controller else self.processes,
+                    api_factory(
+                        self.credentials,
+                        self.url,
+                        timeout=self.http_timeout,
+                        logger_name=self.setup.LOGGER.name,
+                        retries=self.retries,
+                        dead_letter=self.dead_letter,
+                        rate_limiter=self.rate_limiter
+                    )
+            ) as sender:
+                summary = sender.send(payloads, controller)
+        self.api.close()
+        self.setup.LOGGER.info(f'Ingestion summary: {json.dumps(summary)}')
+        self.setup.LOGGER.info(f'All top {self.top_n} most expensive products from branches <{self.branches}> have been ingested.')
 
     def _filter_csvs_by_branches(
             self,
@@ -195,68 +325,102 @@ class Facade:
             units: List[builtins.str]
     ) -> pd.DataFrame:
 
-        dataframe[col_to_extract] = self.manipulate_csv.remove_html_tags(
-            dataframe,
-            col_to_extract
-        )
-        regex_mask = self.manipulate_csv.extract_package_info(
+        dataframe[col_to_extract], packages = self.manipulate_csv.strip_html_and_extract_package(
             dataframe,
             col_to_extract,
             units
         )
-        packages_mask = pd.Series(regex_mask.values.tolist(), index=regex_mask.index).str.join(' ')
-        return packages_mask
+        return packages
 
-    def _separate_by_branch(
+    def _top_n_most_expensive_products(
             self,
             dataframe: pd.DataFrame
-    ) -> Dict[builtins.str, Any]:
-
-        branches = {}
-        for branche in self.branches:
-            branches[branche] = dataframe[self._filter_csvs_by_branches(
-                    self.col.BRANCH,
-                    [branche],
-                    dataframe=dataframe,
-                    return_dataframe=True
-                )
-            ]
-
-        return branches
-
-    @staticmethod
-    def _top_100_most_expensive_products(
-            dataframe: pd.DataFrame,
-            sort_by_column: builtins.str,
     ) -> pd.DataFrame:
 
-        return dataframe.sort_values(by=sort_by_column, ascending=False)[:100]
+        return self.manipulate_csv.top_n_by_group(
+            dataframe,
+            self.col.BRANCH,
+            self.branches,
+            self.col.PRICE,
+            self.top_n
+        )
 
     def _validate_items(
             self,
             dataframe: pd.DataFrame
-    ) -> Dict[builtins.str, Any]:
-
-        items = {}
-        for _, row in dataframe.iterrows():
-            sku = str(row[self.col.SKU])
-            model = IngestItem(
-                merchant_id=self.manipulate_csv.merchant_id,
-                sku=sku,
-                barcodes=[str(row[self.col.BARCODE])],
-                brand=row[self.col.BRAND],
-                name=row[self.col.ITEM_NAME],
-                description=row[self.col.ITEM_DESCRIPTION],
-                package=row[self.col.PACKAGE],
-                image_url=row[self.col.ITEM_IMG],
-                category=row[self.col.CATEGORY_STREAM],
-                url=row[self.col.ITEM_IMG],
-                branch_products=[{
-                    'branch': row[self.col.BRANCH],
-                    'price': row[self.col.PRICE],
-                    'stock': row[self.col.STOCK]
-                }]
+    ) -> Dict[builtins.str, Dict[builtins.str, Any]]:
+        """ Valid items of all branches at once, then keyed
+        by branch and SKU. """
+
+        items, rejected = validate_ingest_items(
+            CSV_SCHEMA.widen_floats(dataframe),
+            merchant_id=self.manipulate_csv.merchant_id,
+            columns={
+                'sku': self.col.SKU,
+                'barcodes': self.col.BARCODE,
+                'brand': self.col.BRAND,
+                'name': self.col.ITEM_NAME,
+                'description': self.col.ITEM_DESCRIPTION,
+                'package': self.col.PACKAGE,
+                'image_url': self.col.ITEM_IMG,
+                'category': self.col.CATEGORY_STREAM,
+                'url': self.col.ITEM_IMG,
+                'branch': self.col.BRANCH,
+                'price': self.col.PRICE,
+                'stock': self.col.STOCK
+            }
+        )
+        if len(rejected):
+            self.setup.LOGGER.warning(
+                f'{len(rejected)} items have not passed validation: '
+                f'{rejected[[self.col.SKU, "reason"]].to_dict("records")}'
             )
-            items[sku] = model.__dict__
 
-        return items
+        items_by_branch: Dict[builtins.str, Dict[builtins.str, Any]] = {
+            branch: {} for branch in self.branches
+        }
+        for item in items:
+            branch = item['branch_products'][0]['branch']
+            items_by_branch.setdefault(branch, {})[item['sku']] = item
+
+        return items_by_branch
+
+
+def replay_failed_products(
+        *,
+        credentials_file: builtins.str,
+        url: builtins.str,
+        items_batch: builtins.int = 10,
+        http_timeout: builtins.float = 30.0,
+        retries: builtins.int = 3,
+        dead_letter: Optional[builtins.str] = None
+) -> Dict[builtins.str, builtins.int]:
+    """ Sends again the products of the dead letter file, with
+    `items_batch` requests in flight; the ones failing again go
+    back to it. """
+
+    setup = IntegrationSetup()
+    dead_letter_ = DeadLetter(dead_letter or setup.dead_letter_path)
+    replaying = dead_letter_.take()
+    if replaying is None:
+        setup.LOGGER.info(f'There are no failed products in {dead_letter_.path}.')
+        return {'ingested': 0, 'failed': 0}
+
+    timeout = (min(5.0, http_timeout), http_timeout)
+    api = API(
+        api=APIOps(
+            str(setup.PARENT_DIR.joinpath(credentials_file).resolve()),
+            url,
+            pool_size=items_batch,
+            timeout=timeout,
+            retry=RetryPolicy(retries)
+        ),
+        logger=setup.LOGGER,
+        dead_letter=dead_letter_
+    )
+    setup.LOGGER.info(f'Replaying failed products of {dead_letter_.path}...')
+    summary = api.send_products_async(DeadLetter.items(replaying), concurrency=items_batch)
+    api.close()
+    os.remove(replaying)
+    setup.LOGGER.info(f'Replay summary: {json.dumps(summary)}')
+    return summary
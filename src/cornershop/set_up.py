@@ -1,13 +1,14 @@
 import builtins
-import json
 import logging
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 import os
 import pathlib
 import sys
-from typing import BinaryIO, Optional, Sequence, Tuple
+import threading
+from typing import Callable, Dict, Optional, Sequence, Tuple
 
-import requests
+from .utils import compression as compression_
+from .utils.download import AssetManifest, Downloader, StreamPipe
 
 
 class IntegrationSetup:
@@ -46,11 +47,44 @@ class IntegrationSetup:
             )
         )
 
+    @property
+    def csv_cache_dir(self) -> builtins.str:
+        return str(self.PARENT_DIR.joinpath(
+                self.__csv_path_joiner(
+                    self._csv_assets_dir,
+                    self._csv_cache_dir_name
+                )
+            )
+        )
+
+    @property
+    def dead_letter_path(self) -> builtins.str:
+        return str(self.PARENT_DIR.joinpath(
+                self.__csv_path_joiner(
+                    self._csv_assets_dir,
+                    self._dead_letter_name
+                )
+            )
+        )
+
+    @property
+    def manifest_path(self) -> builtins.str:
+        return str(self.PARENT_DIR.joinpath(
+                self.__csv_path_joiner(
+                    self._csv_assets_dir,
+                    self._manifest_name
+                )
+            )
+        )
+
     def __init__(self) -> None:
         # ---- SETUP CSVs FILEs NAMEs AND PATHs ----
         self._products_csv_name = self.__CSVs_URL['products'].split('/').pop()
         self._prices_stock_csv_name = self.__CSVs_URL['prices_stock'].split('/').pop()
         self._csv_assets_dir = 'assets'
+        self._csv_cache_dir_name = '.cache'
+        self._dead_letter_name = 'failed_products.ndjson'
+        self._manifest_name = '.manifest.json'
         self._csvs_path = [
             self.products_csv_path,
             self.prices_stock_csv_path,
@@ -75,66 +109,143 @@ class IntegrationSetup:
 
         return '/'.join((asset_path, csv_name))
 
-    def main(self) -> None:
-        not_cfe = self.__check_csvs_existence()
-        if not_cfe:
-            self.__download_csv_files()
+    def main(
+            self,
+            *,
+            segments: builtins.int = 4,
+            compression: Optional[builtins.str] = None
+    ) -> None:
+        """ Downloads the CSVs missing or changed since they were
+        downloaded, as the assets manifest says; stored compressed as
+        `compression` ('gzip' or 'zstd') if given. """
 
-    def __check_csvs_existence(self) -> Sequence[Optional[builtins.str]]:
+        self.__download_csv_files(segments, compression)
+
+    def __check_csvs_existence(self, compression: Optional[builtins.str]) -> Sequence[Optional[builtins.str]]:
 
         notfound = []
         for csv_path in self._csvs_path:
-            if not os.path.exists(csv_path):
+            if not os.path.exists(compression_.stored_path(csv_path, compression)):
                 notfound.append(csv_path)
 
         return notfound
 
-    def __download_csv_files(self) -> None:
+    def __download_csv_files(self, segments: builtins.int, compression: Optional[builtins.str]) -> None:
         self.__check_dir_existence(self._csv_assets_dir)
+        notfound = self.__check_csvs_existence(compression)
+        manifest = AssetManifest(self.manifest_path)
         urls = self.__CSVs_URL.values()
         zip_ = [
             (urls_, csvs_path) for
             urls_, csvs_path in
             zip(urls, self._csvs_path)
         ]
-        p = Pool(processes=5)
-        p.map(self.download, zip_)
+        # downloads wait on the network, so threads are enough.
+        with ThreadPoolExecutor(max_workers=len(zip_)) as executor:
+            list(executor.map(
+                lambda url_and_csv_path: self.download(
+                    url_and_csv_path,
+                    segments=segments,
+                    manifest=manifest,
+                    found=url_and_csv_path[1] not in notfound,
+                    compression=compression
+                ),
+                zip_
+            ))
+
+    def open_streams(
+            self,
+            *,
+            segments: builtins.int = 4,
+            compression: Optional[builtins.str] = None
+    ) -> Dict[builtins.str, StreamPipe]:
+        """ Downloads the CSVs as `main` does, but in the background,
+        returning by CSV path a pipe its bytes come through, in order; a
+        failed download makes its pipe raise.
+
+        Both are downloaded at once. Prices stock bytes go through as
+        they arrive, but products are only read, from disk, once fully
+        downloaded: they can't be filtered before all stock SKUs are
+        known, and waiting in the pipe they would stall their download. """
+
+        self.__check_dir_existence(self._csv_assets_dir)
+        manifest = AssetManifest(self.manifest_path)
+        pipes = {csv_path: StreamPipe() for csv_path in self._csvs_path}
+
+        def download(url_and_csv_path: Tuple[builtins.str, builtins.str], *, stream: builtins.bool) -> None:
+            csv_path = url_and_csv_path[1]
+            stored_path = compression_.stored_path(csv_path, compression)
+            try:
+                completed = self.download(
+                    url_and_csv_path,
+                    segments=segments,
+                    manifest=manifest,
+                    found=os.path.exists(stored_path),
+                    sink=pipes[csv_path].write if stream else None,
+                    compression=compression
+                )
+                if completed and not stream:
+                    with compression_.open_reader(stored_path) as f:
+                        for block in iter(lambda: f.read(1 << 20), b''):
+                            pipes[csv_path].write(block)
+            except Exception as e:
+                # the pipe's reader raises it.
+                self.LOGGER.error(f'{csv_path} download failed: {e!r}')
+                pipes[csv_path].finish(e)
+                return
+            pipes[csv_path].finish(None if completed else IOError(f'{csv_path} download failed.'))
+
+        for url_and_csv_path, stream in (
+                ((self.__CSVs_URL['prices_stock'], self.prices_stock_csv_path), True),
+                ((self.__CSVs_URL['products'], self.products_csv_path), False),
+        ):
+            threading.Thread(
+                target=download,
+                args=(url_and_csv_path,),
+                kwargs={'stream': stream},
+                daemon=True
+            ).start()
+
+        return pipes
 
     def download(
             self,
-            url_and_csv_path: Tuple[builtins.str, builtins.str]
-    ) -> None:
+            url_and_csv_path: Tuple[builtins.str, builtins.str],
+            *,
+            segments: builtins.int = 4,
+            manifest: Optional[AssetManifest] = None,
+            found: builtins.bool = False,
+            sink: Optional[Callable[[builtins.bytes], object]] = None,
+            compression: Optional[builtins.str] = None
+    ) -> builtins.bool:
+        """ Downloads a CSV to its path, or to its compressed variant's
+        with `compression`, removing the variants it replaces. """
 
-        url, csv_filepath = url_and_csv_path
-        with open(csv_filepath, 'w+b') as f:
+        url, csv_path = url_and_csv_path
+        csv_filepath = compression_.stored_path(csv_path, compression)
+        if found:
+            self.LOGGER.info(f'{csv_filepath} has been found, checking whether it has changed.')
+        else:
             self.LOGGER.info(
                 f'{csv_filepath} has not been found.'
                 ' Downloading has been started.'
             )
-            try:
-                r = requests.get(
-                    url,
-                    stream=True
-                )
-            except Exception as e:
-                self.LOGGER.exception(e.args[0])
-
-            else:
-                if not self.__process_downloading_stream(
-                        file_obj=f,
-                        file_path=csv_filepath,
-                        stream=r
-                ):
-
-                    self.LOGGER.error(
-                        f'{csv_filepath}'
-                        'is not complete.'
-                    )
-                else:
-                    sys.stdout.write(
-                    f'\n{csv_filepath} '
-                    'Download completed.\n'
-                    )
+        completed = Downloader(
+            segments=segments,
+            compression=compression,
+            logger=self.LOGGER
+        ).download(url, csv_filepath, manifest, sink)
+        if completed:
+            for variant in (csv_path, *(csv_path + suffix for suffix in compression_.SUFFIXES.values())):
+                if variant != csv_filepath and os.path.exists(variant):
+                    # readers take the newest variant, so an old one must not linger.
+                    os.remove(variant)
+            sys.stdout.write(
+                f'\n{csv_filepath} '
+                'is up to date.\n'
+            )
+
+        return completed
 
     def __check_dir_existence(
             self,
@@ -146,45 +257,3 @@ class IntegrationSetup:
 
         if not os.path.exists(assets_dir):
             os.makedirs(assets_dir)
-
-    def __process_downloading_stream(
-            self,
-            file_obj: BinaryIO,
-            file_path: builtins.str,
-            stream: requests.Response
-    ) -> builtins.bool:
-
-        file_size = int(
-            stream.headers.get('content-length')
-        )
-        self.LOGGER.info(
-            json.dumps(
-                {
-                    'csv name': file_path,
-                    'csv size (MB)': file_size / (1024 * 1000)
-                }
-            )
-        )
-
-        chunks_downloaded_sofar = 0
-        csv_filobj_cursor_position = file_obj.tell()
-        for chunk in stream.iter_content(chunk_size=4096):
-            chunks_downloaded_sofar += len(chunk)
-            file_obj.write(chunk)
-            progress_bar = int(
-                25 * chunks_downloaded_sofar / file_size
-            )
-            sys.stdout.write(
-                '\r[%s%s]' % (
-                    '=' * progress_bar,
-                    ' ' * (25 - progress_bar)
-                )
-            )
-            sys.stdout.flush()
-
-        else:
-            total_chunks_downloaded = chunks_downloaded_sofar
-
-        file_obj.seek(csv_filobj_cursor_position)
-        csv_content_length = len(file_obj.read())
-        return total_chunks_downloaded == csv_content_length
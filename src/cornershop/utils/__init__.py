@@ -1,3 +1,10 @@
 from .api import API, APIOps
+from .concurrency import AIMDController, BatchSizer
 from .csv_manipulation import CSVOps, PandasOperations
-from .models import IngestItem
+from .csv_schema import CSVSchema
+from .dead_letter import DeadLetter
+from .models import IngestItem, validate_ingest_items
+from .payload import encode_products, ProductPayload
+from .rate_limit import RateLimiter
+from .retry import RetryPolicy
+from .workers import ProductSender, api_factory
@@ -1,20 +1,41 @@
 """ The request/response cycle is known because of the docs
 https://documenter.getpostman.com/view/1992239/TVmMgxxp#c76cbd6d-bbac-4853-8d7a-ff86b76f7127
-and through local docker server requests tests. So
-there are no try/except, control flows statements or
-any sort of fine grained control of the requests.
+and through local docker server requests tests.
+
+Requests are authenticated with a cached token, refreshed ahead of its
+expiry and once more on a 401. Failed product requests (connection
+errors, 429 and 5xx) are retried as `RetryPolicy` says, paced by an
+optional `RateLimiter`, and the ones that still fail are written to a
+`DeadLetter` file to be replayed later.
 """
 
 import abc
+import asyncio
 import base64
 import builtins
 import enum
+import gzip
+import hashlib
 import json
 import logging
+import os
 import pathlib
-from typing import Any, cast, Dict, Tuple, Union
+import time
+from typing import Any, Callable, cast, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
 
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+
+from .concurrency import AIMDController, BatchSizer
+from .dead_letter import DeadLetter
+from .payload import encode_json, Product, ProductPayload
+from .rate_limit import RateLimiter
+from .retry import RetryPolicy
+
+AttemptHook = Callable[[Optional[builtins.int], builtins.float], None]
+""" Takes the status (None if the request failed) and latency of every
+attempt at sending a product, retries included, e.g. `AIMDController.record`. """
 
 
 class APIEnum(enum.auto):
@@ -33,7 +54,7 @@ class APIEnum(enum.auto):
 class APIOpsInterface(abc.ABC):
 
     @abc.abstractmethod
-    def _token(self) -> None:
+    def _token(self, force: builtins.bool = False) -> None:
 
         pass
 
@@ -83,34 +104,246 @@ class APIOpsInterface(abc.ABC):
     @abc.abstractmethod
     def send_product_data(
             self,
-            product: Dict[builtins.str, Any]
+            product: Product,
+            *,
+            on_attempt: Optional[AttemptHook] = None
+    ) -> builtins.int:
+
+        pass
+
+    @abc.abstractmethod
+    def send_product_batch(
+            self,
+            payload: builtins.bytes,
+            *,
+            encoding: Optional[builtins.str] = None
+    ) -> builtins.int:
+
+        pass
+
+    @abc.abstractmethod
+    def async_session(self, limit: builtins.int) -> aiohttp.ClientSession:
+
+        pass
+
+    @abc.abstractmethod
+    async def send_product_data_async(
+            self,
+            session: aiohttp.ClientSession,
+            product: Product,
+            *,
+            on_attempt: Optional[AttemptHook] = None
     ) -> builtins.int:
 
         pass
 
+    @abc.abstractmethod
+    def close(self) -> None:
+
+        pass
+
+
+class MerchantDirectory:
+    """ Merchants list kept in memory, indexed by id and name, so
+    looking a merchant up does not download the list again. It is
+    fresh for `ttl` seconds, then revalidated with its ETag. """
+
+    def __init__(self, ttl: builtins.float = 60.0) -> None:
+
+        self.ttl = ttl
+        self.etag: Optional[builtins.str] = None
+        self.loaded = False
+        self._fetched_at = 0.0
+        self._by_id: Dict[builtins.str, Dict[builtins.str, Any]] = {}
+        self._by_name: Dict[builtins.str, List[builtins.str]] = {}
+
+    @property
+    def is_fresh(self) -> builtins.bool:
+        return self.loaded and time.monotonic() - self._fetched_at < self.ttl
+
+    def load(self, merchants: List[Dict[builtins.str, Any]], etag: Optional[builtins.str]) -> None:
+
+        self._by_id = {}
+        self._by_name = {}
+        for merchant in merchants:
+            self.put(merchant)
+        self.etag = etag
+        self.loaded = True
+        self.touch()
+
+    def touch(self) -> None:
+        self._fetched_at = time.monotonic()
+
+    def find(self, merchant_name: builtins.str) -> Optional[Dict[builtins.str, Any]]:
+        """ Last merchant named `merchant_name`, or else the last one
+        whose name contains it, as the API filter used to do. """
+
+        ids = self._by_name.get(merchant_name)
+        if not ids:
+            ids = [
+                id_ for name, name_ids in self._by_name.items()
+                if merchant_name in name for id_ in name_ids
+            ]
+        return self._by_id[ids[-1]] if ids else None
+
+    def put(self, merchant: Dict[builtins.str, Any]) -> None:
+
+        if APIEnum.ID not in merchant:
+            return
+        self.remove(merchant[APIEnum.ID])
+        self._by_id[merchant[APIEnum.ID]] = dict(merchant)
+        self._by_name.setdefault(merchant[APIEnum.NAME], []).append(merchant[APIEnum.ID])
+
+    def remove(self, merchant_id: builtins.str) -> None:
+
+        merchant = self._by_id.pop(merchant_id, None)
+        if merchant is not None:
+            self._by_name[merchant[APIEnum.NAME]].remove(merchant_id)
+            if not self._by_name[merchant[APIEnum.NAME]]:
+                del self._by_name[merchant[APIEnum.NAME]]
+
 
 class APIOps(APIOpsInterface):
 
     _API = APIEnum()
 
-    def __init__(self, credentials_file: builtins.str, url: builtins.str) -> None:
+    TOKEN_REFRESH_MARGIN = 60.0
+    """ Seconds before expiry a token is already refreshed. """
+
+    def __init__(
+            self,
+            credentials_file: builtins.str,
+            url: builtins.str,
+            *,
+            pool_size: builtins.int = 10,
+            timeout: Tuple[builtins.float, builtins.float] = (5.0, 30.0),
+            token_cache: Optional[builtins.str] = None,
+            merchants_ttl: builtins.float = 60.0,
+            retry: Optional[RetryPolicy] = None,
+            rate_limiter: Optional[RateLimiter] = None
+    ) -> None:
 
         self.headers: Dict[builtins.str, builtins.str] = {}
         self._BASE_URL = url
         self.credentials = str(pathlib.Path(__file__).parent.parent.joinpath(credentials_file).resolve())
+        self.token_cache = token_cache or self._token_cache_path(self.credentials)
+        self.token_expires_at: Optional[builtins.float] = None
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[builtins.int] = None
+        self._token_refresh: 'Optional[asyncio.Future[None]]' = None
+        self.merchants = MerchantDirectory(ttl=merchants_ttl)
+        self.retry = retry or RetryPolicy()
+        self.rate_limiter = rate_limiter
         self._token()
 
-    def _token(self) -> None:
+    @property
+    def session(self) -> requests.Session:
+        """ Keep-alive session, so requests reuse pooled connections.
+        There is one by process: a forked worker builds its own instead
+        of sharing the parent's sockets. """
+
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+            self._session_pid = os.getpid()
+
+        return self._session
+
+    def close(self) -> None:
+
+        if self._session is not None and self._session_pid == os.getpid():
+            self._session.close()
+        self._session = None
+        self._session_pid = None
+
+    def __getstate__(self) -> Dict[builtins.str, Any]:
+        # sessions are not sent to other processes, see `session`.
+        state = self.__dict__.copy()
+        state['_session'] = None
+        state['_session_pid'] = None
+        state['_token_refresh'] = None
+        return state
+
+    @staticmethod
+    def _token_cache_path(credentials: builtins.str) -> builtins.str:
+        # e.g. .config.json -> .config.token.json, next to it.
+        root, ext = os.path.splitext(credentials)
+        return f'{root}.token{ext or ".json"}'
+
+    def _token(self, force: builtins.bool = False) -> None:
+        """ Sets the token header, from the token cache file when it holds
+        a token of these credentials and host that is not about to expire
+        (e.g. got by a previous run or another worker), otherwise from the
+        API. `force` skips the cache, e.g. when the server refused it. """
 
-        base_url = self._url_joiner(
-            self._BASE_URL, self._API.TOKEN
-        )
         with open(self.credentials, 'r') as f:
-            credentials = json.load(f)
+            raw_credentials = f.read()
+        owner = hashlib.sha256(f'{self._BASE_URL}|{raw_credentials}'.encode()).hexdigest()
 
-        params = self._decode_credentials(credentials)
-        r = requests.post(base_url, params=params)
-        self.headers = {'token': f'Bearer {r.json()["access_token"]}'}
+        cached = None if force else self._read_token_cache(owner)
+        if cached is None:
+            base_url = self._url_joiner(
+                self._BASE_URL, self._API.TOKEN
+            )
+            params = self._decode_credentials(json.loads(raw_credentials))
+            r = self.session.post(base_url, params=params, timeout=self.timeout)
+            token = r.json()
+            expires_in = token.get('expires_in')
+            cached = {
+                'owner': owner,
+                'access_token': token['access_token'],
+                'expires_at': time.time() + builtins.float(expires_in) if expires_in else None
+            }
+            self._write_token_cache(cached)
+
+        self.token_expires_at = cached['expires_at']
+        self.headers = {'token': f'Bearer {cached["access_token"]}'}
+
+    def _read_token_cache(self, owner: builtins.str) -> Optional[Dict[builtins.str, Any]]:
+
+        try:
+            with open(self.token_cache, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(cached, builtins.dict) or cached.get('owner') != owner \
+                or not cached.get('access_token') or self._is_expiring(cached.get('expires_at')):
+            return None
+
+        return cached
+
+    def _write_token_cache(self, cached: Dict[builtins.str, Any]) -> None:
+        """ Written owner-only (0600) and swapped in with a rename, so
+        concurrent workers never read half a file. """
+
+        tmp_path = f'{self.token_cache}.{os.getpid()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cached, f)
+        os.replace(tmp_path, self.token_cache)
+
+    def _is_expiring(self, expires_at: Optional[builtins.float]) -> builtins.bool:
+        return expires_at is not None and time.time() >= expires_at - self.TOKEN_REFRESH_MARGIN
+
+    def _request(self, method: builtins.str, url: builtins.str, **kwargs: Any) -> requests.Response:
+        """ Authenticated request: the token is refreshed ahead of its
+        expiry, and once more, retrying the request, on a 401. """
+
+        extra_headers = kwargs.pop('headers', {})
+        if self._is_expiring(self.token_expires_at):
+            self._token()
+        r = self.session.request(method, url, headers={**self.headers, **extra_headers}, timeout=self.timeout, **kwargs)
+        if r.status_code == 401:
+            self._token(force=True)
+            r = self.session.request(method, url, headers={**self.headers, **extra_headers}, timeout=self.timeout, **kwargs)
+
+        return r
 
     @staticmethod
     def _decode_credentials(
@@ -127,18 +360,38 @@ class APIOps(APIOpsInterface):
         Union[builtins.str, builtins.bool]
     ]:
 
-        url = self._url_joiner(
+        self._refresh_merchants()
+        merchant = self.merchants.find(merchant_name)
+        if merchant is None:
+            raise IndexError(f'merchant {merchant_name} has not been found.')
+
+        return dict(merchant)
+
+    def _refresh_merchants(self) -> None:
+        """ Downloads the merchants list, following its pages, unless
+        the directory is fresh or the server says it did not change. """
+
+        if self.merchants.is_fresh:
+            return
+
+        url: Optional[builtins.str] = self._url_joiner(
             self._BASE_URL, self._API.MERCHANTS
         )
-        r = requests.get(url, headers=self.headers)
-        richards = list(
-            filter(
-                lambda x: merchant_name in
-                          x[self._API.NAME] and self._API.ID in x,
-                r.json()[self._API.MERCHANTS_INFO]
-            )
-        )
-        return richards.pop()
+        headers = {'If-None-Match': self.merchants.etag} if self.merchants.loaded and self.merchants.etag else {}
+        merchants = []
+        etag = None
+        while url:
+            r = self._request('GET', url, headers=headers)
+            if r.status_code == 304:
+                self.merchants.touch()
+                return
+            body = r.json()
+            merchants.extend(body[self._API.MERCHANTS_INFO])
+            etag = etag or r.headers.get('ETag')
+            url = r.links.get('next', {}).get('url') or body.get('next')
+            headers = {}
+
+        self.merchants.load(merchants, etag)
 
     def update_merchant_info(
             self,
@@ -153,7 +406,11 @@ class APIOps(APIOpsInterface):
             self._BASE_URL,
             self._API.MERCHANTS_BY_ID.format(mi[self._API.ID])
         )
-        requests.put(url, headers=self.headers, json=mi)
+        r = self._request('PUT', url, json=mi)
+        if r.ok:
+            # the directory is right, but no longer what the ETag names.
+            self.merchants.put(mi)
+            self.merchants.etag = None
 
     @staticmethod
     def _url_joiner(
@@ -170,33 +427,184 @@ class APIOps(APIOpsInterface):
             merchant_name: builtins.str
     ) -> None:
 
-        mi = self.merchant_info(merchant_name)
+        merchant_id = cast(builtins.str, self.merchant_info(merchant_name)[self._API.ID])
         url = self._url_joiner(
             self._BASE_URL,
-            self._API.MERCHANTS_BY_ID.format(mi[self._API.ID])
+            self._API.MERCHANTS_BY_ID.format(merchant_id)
         )
-        requests.delete(url, headers=self.headers)
+        r = self._request('DELETE', url)
+        if r.ok:
+            self.merchants.remove(merchant_id)
+            self.merchants.etag = None
 
     def send_product_data(
             self,
-            product: Dict[builtins.str, Any]
+            product: Product,
+            *,
+            on_attempt: Optional[AttemptHook] = None
     ) -> builtins.int:
 
+        return self._post_product(on_attempt=on_attempt, **self._product_body(product))
+
+    def send_product_batch(
+            self,
+            payload: builtins.bytes,
+            *,
+            encoding: Optional[builtins.str] = None
+    ) -> builtins.int:
+        """ Posts many products at once, `payload` being their JSON
+        array, encoded as `encoding` says (e.g. gzip). """
+
+        return self._post_product(
+            data=payload,
+            headers={'Content-Type': 'application/json', **({'Content-Encoding': encoding} if encoding else {})}
+        )
+
+    @staticmethod
+    def _product_body(product: Product) -> Dict[builtins.str, Any]:
+        """ Request arguments posting `product`: a payload is sent
+        as it is, a dict is serialized. """
+
+        if isinstance(product, ProductPayload):
+            return {'data': product.data, 'headers': product.headers}
+        return {'json': product}
+
+    def _post_product(self, *, on_attempt: Optional[AttemptHook] = None, **kwargs: Any) -> builtins.int:
+        """ Response status of posting to the products path, retried
+        as `self.retry` says; `on_attempt` hears of every attempt. """
+
         url = self._url_joiner(
             self._BASE_URL,
             self._API.PRODUCTS
         )
-        r = requests.post(url, headers=self.headers, json=product)
-        return r.status_code
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            started = time.monotonic()
+            try:
+                r = self._request('POST', url, **kwargs)
+            except requests.RequestException:
+                if on_attempt:
+                    on_attempt(None, time.monotonic() - started)
+                if self.rate_limiter:
+                    self.rate_limiter.update(None, {}, issued_at=started)
+                if attempt >= self.retry.retries:
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                if on_attempt:
+                    on_attempt(r.status_code, time.monotonic() - started)
+                if self.rate_limiter:
+                    self.rate_limiter.update(r.status_code, r.headers, issued_at=started)
+                if attempt >= self.retry.retries or not self.retry.is_retryable(r.status_code):
+                    return r.status_code
+                delay = self.retry.delay(attempt, r.headers.get('Retry-After'))
+            time.sleep(delay)
+            attempt += 1
+
+    def async_session(self, limit: builtins.int) -> aiohttp.ClientSession:
+        """ Session for `send_product_data_async`, keeping up to
+        `limit` connections alive. It must be used inside a running
+        event loop. """
+
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit),
+            timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        )
+
+    async def send_product_data_async(
+            self,
+            session: aiohttp.ClientSession,
+            product: Product,
+            *,
+            on_attempt: Optional[AttemptHook] = None
+    ) -> builtins.int:
+
+        url = self._url_joiner(
+            self._BASE_URL,
+            self._API.PRODUCTS
+        )
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                await self.rate_limiter.acquire_async()
+            started = time.monotonic()
+            try:
+                status, headers = await self._post_product_async(session, url, product)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if on_attempt:
+                    on_attempt(None, time.monotonic() - started)
+                if self.rate_limiter:
+                    self.rate_limiter.update(None, {}, issued_at=started)
+                if attempt >= self.retry.retries:
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                if on_attempt:
+                    on_attempt(status, time.monotonic() - started)
+                if self.rate_limiter:
+                    self.rate_limiter.update(status, headers, issued_at=started)
+                if attempt >= self.retry.retries or not self.retry.is_retryable(status):
+                    return status
+                delay = self.retry.delay(attempt, headers.get('Retry-After'))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _post_product_async(
+            self,
+            session: aiohttp.ClientSession,
+            url: builtins.str,
+            product: Product
+    ) -> Tuple[builtins.int, Mapping[builtins.str, builtins.str]]:
+
+        if self._is_expiring(self.token_expires_at):
+            await self._token_async()
+        body = self._product_body(product)
+        extra_headers = body.pop('headers', {})
+        headers = self.headers
+        async with session.post(url, headers={**headers, **extra_headers}, **body) as r:
+            # an unread body would close the connection instead of reusing it.
+            await r.read()
+            status, response_headers = r.status, r.headers
+        if status == 401:
+            # only the first of many concurrent 401s gets a new token.
+            if self.headers is headers:
+                await self._token_async(force=True)
+            async with session.post(url, headers={**self.headers, **extra_headers}, **body) as r:
+                await r.read()
+                status, response_headers = r.status, r.headers
+
+        return status, response_headers
+
+    async def _token_async(self, force: builtins.bool = False) -> None:
+        """ `_token` in a worker thread, so the requests in flight go on
+        while it blocks; concurrent callers wait for the same refresh. """
+
+        if self._token_refresh is None or self._token_refresh.done():
+            self._token_refresh = asyncio.get_running_loop().run_in_executor(None, self._token, force)
+        # shielded: a cancelled caller must not cancel the others' refresh.
+        await asyncio.shield(self._token_refresh)
 
 
 class API:
 
     _API = APIEnum()
 
-    def __init__(self, *, api: APIOpsInterface, logger: logging.Logger) -> None:
+    def __init__(
+            self,
+            *,
+            api: APIOpsInterface,
+            logger: logging.Logger,
+            dead_letter: Optional[DeadLetter] = None
+    ) -> None:
+
         self._api = api
         self._logger = logger
+        self._dead_letter = dead_letter
+        self._bulk_supported: Optional[builtins.bool] = None
+        """ Whether the server takes bulk requests, once known. """
+        self._bulk_compress = False
 
     def merchant_id(self, merchant_name: builtins.str) -> builtins.str:
         return cast(builtins.str, self._api.merchant_info(merchant_name)[self._API.ID])
@@ -217,14 +625,218 @@ class API:
     def delete_merchant_info(self, merchant_name: builtins.str) -> None:
         self._api.delete_merchant_info(merchant_name)
 
+    def close(self) -> None:
+        self._api.close()
+
     def send_products(
             self,
-            product: Tuple[builtins.int, Dict[builtins.str, Any]]
-    ) -> None:
+            product: Tuple[builtins.int, Product],
+            *,
+            on_attempt: Optional[AttemptHook] = None
+    ) -> Optional[builtins.int]:
+        """ Returns the response status, None if the request failed. """
 
         item_number, item = product
-        response = self._api.send_product_data(item)
+        try:
+            response: Optional[builtins.int] = self._api.send_product_data(item, on_attempt=on_attempt)
+        except requests.RequestException as e:
+            self._logger.error(f'Product number {item_number} request failed: {e!r}')
+            response = None
+        self._log_product_response(item_number, item, response)
+        return response
+
+    def send_products_async(
+            self,
+            items: Iterable[Product],
+            *,
+            concurrency: builtins.int,
+            controller: Optional[AIMDController] = None
+    ) -> Dict[builtins.str, builtins.int]:
+        """ Sends `items` from one process with up to `concurrency`
+        requests in flight, logging each one as `send_products` does.
+        With a `controller`, the concurrency is its instead, which adapts
+        to the responses. Returns how many have been ingested and how
+        many failed, plus the concurrency it ended with. """
+
+        return asyncio.run(self._send_products_async(items, concurrency, controller))
+
+    async def _send_products_async(
+            self,
+            items: Iterable[Product],
+            concurrency: builtins.int,
+            controller: Optional[AIMDController]
+    ) -> Dict[builtins.str, builtins.int]:
+
+        summary = {'ingested': 0, 'failed': 0}
+        products = enumerate(items, start=1)
+        workers = controller.maximum if controller else concurrency
+        in_flight = 0
+        slot_freed = asyncio.Condition()
+
+        def has_free_slot() -> builtins.bool:
+            return in_flight < (controller.concurrency if controller else concurrency)
+
+        async def worker(session: aiohttp.ClientSession, products: Iterator[Tuple[builtins.int, Product]]) -> None:
+            nonlocal in_flight
+            # workers share the iterator, so only in flight items are in memory.
+            while True:
+                async with slot_freed:
+                    await slot_freed.wait_for(has_free_slot)
+                    product = next(products, None)
+                    if product is None:
+                        return
+                    in_flight += 1
+                item_number, item = product
+                try:
+                    # every attempt, so retried 429/5xx still make it back off.
+                    response: Optional[builtins.int] = await self._api.send_product_data_async(
+                        session, item, on_attempt=controller.record if controller else None
+                    )
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self._logger.error(f'Product number {item_number} request failed: {e!r}')
+                    response = None
+                summary['ingested' if response == 200 else 'failed'] += 1
+                self._log_product_response(item_number, item, response)
+                async with slot_freed:
+                    in_flight -= 1
+                    slot_freed.notify_all()
+
+        async with self._api.async_session(limit=workers) as session:
+            await asyncio.gather(*(worker(session, products) for _ in range(workers)))
+
+        if controller:
+            summary['concurrency'] = controller.concurrency
+        return summary
+
+    BULK_UNSUPPORTED = (404, 405, 415, 501)
+    """ Statuses telling a bulk request is not supported at all. """
+
+    def send_products_bulk(
+            self,
+            items: Iterable[Product],
+            *,
+            max_items: builtins.int = 500,
+            max_bytes: builtins.int = 1_000_000,
+            compress: builtins.bool = False
+    ) -> Dict[builtins.str, builtins.int]:
+        """ Sends `items` in bulk requests (JSON arrays) of up to
+        `max_items` products and `max_bytes` bytes, sized on the fly as
+        `BatchSizer` says. A failed batch is split in halves, down to
+        single products sent as `send_products` does, so only the bad
+        ones fail. If the server does not take arrays, every product is
+        sent alone instead. With `compress`, requests are gzipped (the
+        limits stay on their uncompressed size). Returns how many have
+        been ingested, how many failed and how many requests it took. """
+
+        summary = {'ingested': 0, 'failed': 0, 'requests': 0}
+        sizer = BatchSizer(max_items, max_bytes)
+        self._bulk_compress = compress
+        products = (
+            (item_number, item, item.json if isinstance(item, ProductPayload) else encode_json(item))
+            for item_number, item in enumerate(items, start=1)
+        )
+        # chunks are made lazily, so each one follows the limits of the time.
+        for batch in self._chunks(products, sizer):
+            self._send_batch(batch, sizer, summary)
+
+        return summary
+
+    def _send_batch(
+            self,
+            batch: List[Tuple[builtins.int, Product, builtins.bytes]],
+            sizer: BatchSizer,
+            summary: Dict[builtins.str, builtins.int]
+    ) -> builtins.bool:
+        """ Whether every product of `batch` has been ingested. """
+
+        status: Optional[builtins.int]
+        if len(batch) == 1 or self._bulk_supported is False:
+            ingested = True
+            for item_number, item, _ in batch:
+                summary['requests'] += 1
+                status = self.send_products((item_number, item))
+                summary['ingested' if status == 200 else 'failed'] += 1
+                ingested = ingested and status == 200
+            return ingested
+
+        payload = b'[' + b','.join(body for _, _, body in batch) + b']'
+        if not sizer.fits(len(batch), len(payload)):
+            # the limits shrank since this batch was made.
+            ingested = True
+            for chunk in self._chunks(batch, sizer):
+                ingested = self._send_batch(chunk, sizer, summary) and ingested
+            return ingested
+
+        summary['requests'] += 1
+        try:
+            if self._bulk_compress:
+                status = self._api.send_product_batch(
+                    gzip.compress(payload, compresslevel=6, mtime=0),
+                    encoding='gzip'
+                )
+            else:
+                status = self._api.send_product_batch(payload)
+        except requests.RequestException as e:
+            self._logger.error(
+                f'Products numbers {batch[0][0]} to {batch[-1][0]} request failed: {e!r}'
+            )
+            status = None
+        sizer.record(status, len(batch), len(payload))
+
+        if status == 200:
+            self._bulk_supported = True
+            summary['ingested'] += len(batch)
+            self._logger.info(f'Ingested products numbers: {batch[0][0]} to {batch[-1][0]}')
+            return True
+        if self._bulk_supported is None and status in self.BULK_UNSUPPORTED:
+            self._bulk_supported = False
+            self._logger.warning(f'Bulk requests are not supported ({status}), sending products one by one.')
+            return self._send_batch(batch, sizer, summary)
+
+        half = len(batch) // 2
+        ingested = self._send_batch(batch[:half], sizer, summary)
+        ingested = self._send_batch(batch[half:], sizer, summary) and ingested
+        if ingested and self._bulk_supported is None and status is not None and 400 <= status < 500 \
+                and status not in (413, 429):
+            # every product is fine on its own, so arrays are what the server refused.
+            self._bulk_supported = False
+            self._logger.warning(f'Bulk requests are not supported ({status}), sending products one by one.')
+        return ingested
+
+    @staticmethod
+    def _chunks(
+            batch: Iterable[Tuple[builtins.int, Product, builtins.bytes]],
+            sizer: BatchSizer
+    ) -> Iterator[List[Tuple[builtins.int, Product, builtins.bytes]]]:
+
+        chunk: List[Tuple[builtins.int, Product, builtins.bytes]] = []
+        size = 2
+        for product in batch:
+            if chunk and not sizer.fits(len(chunk) + 1, size + len(product[2]) + 1):
+                yield chunk
+                chunk, size = [], 2
+            chunk.append(product)
+            size += len(product[2]) + 1
+        if chunk:
+            yield chunk
+
+    def _log_product_response(
+            self,
+            item_number: builtins.int,
+            item: Product,
+            response: Optional[builtins.int]
+    ) -> None:
+
         if response == 200:
             self._logger.info(f'Ingested product number: {item_number}')
-        else:
+            return
+        if isinstance(item, ProductPayload):
+            item = item.item
+        if self._dead_letter is None:
             self._logger.error(f'Product has not been ingested: {item}')
+        else:
+            self._dead_letter.append(item, response)
+            self._logger.error(
+                f'Product number {item_number} (sku {item.get("sku")}) has not been '
+                f'ingested ({response}), it has been sent to {self._dead_letter.path}'
+            )
@@ -9,7 +9,7 @@ import json
 import os.path
 import pathlib
 
-from ..ingestion import Facade
+from ..ingestion import Facade, replay_failed_products
 from ..set_up import IntegrationSetup
 
 
@@ -21,9 +21,26 @@ def integration_setup() -> None:
         action='store_true',
         help='Start setup of integration test.'
     )
+    parser.add_argument(
+        '--segments',
+        dest='segments',
+        action='store',
+        default=4,
+        help='HTTP Range segments each CSV is downloaded in, in parallel.',
+        type=builtins.int
+    )
+    parser.add_argument(
+        '--compress',
+        dest='compression',
+        action='store',
+        default=None,
+        choices=('gzip', 'zstd'),
+        help='Store the CSVs compressed (zstd needs the zstandard package); '
+             'they are read back transparently.'
+    )
     args = parser.parse_args()
     if args.setup:
-        IntegrationSetup().main()
+        IntegrationSetup().main(segments=args.segments, compression=args.compression)
 
 def oauth_setup() -> None:
     parser = argparse.ArgumentParser()
@@ -137,6 +154,127 @@ def ingestion() -> None:
         help='How many to ingest simultaneously.',
         type=builtins.int
     )
+    parser.add_argument(
+        '--max-products-batch',
+        dest='max_items_batch',
+        action='store',
+        default=None,
+        help='Adapt how many to ingest simultaneously, starting from '
+             '--products-batch and up to this many: it grows while the '
+             'API answers well and backs off on 429/5xx or slower answers.',
+        type=builtins.int
+    )
+    parser.add_argument(
+        '--retries',
+        dest='retries',
+        action='store',
+        default=3,
+        help='Times a product is sent again on a failed request, '
+             '429 or 5xx, waiting exponentially longer each time.',
+        type=builtins.int
+    )
+    parser.add_argument(
+        '--dead-letter',
+        dest='dead_letter',
+        action='store',
+        default=None,
+        help='File where products that could not be ingested are '
+             'appended, see ingestion-replay. Default: assets/failed_products.ndjson',
+        type=builtins.str
+    )
+    parser.add_argument(
+        '--ingest-engine',
+        dest='ingest_engine',
+        action='store',
+        choices=['processes', 'threads', 'asyncio', 'bulk'],
+        default='processes',
+        help='Send products from a pool of --products-batch processes or '
+             'threads, from one process with --products-batch '
+             'requests in flight (asyncio), or many by request (bulk).',
+        type=builtins.str
+    )
+    parser.add_argument(
+        '--rate-limit',
+        dest='rate_limit',
+        action='store',
+        default=None,
+        help='Most product requests by second, shared by every worker; '
+             'lowered on the fly when the API throttles. Default: no limit',
+        type=builtins.float
+    )
+    parser.add_argument(
+        '--rate-burst',
+        dest='rate_burst',
+        action='store',
+        default=None,
+        help='Most product requests sent at once under --rate-limit. '
+             'Default: one second worth of them',
+        type=builtins.float
+    )
+    parser.add_argument(
+        '--download',
+        dest='download_csvs',
+        action='store_true',
+        help='Download (or update) the CSVs as integration --setup does, '
+             'parsing prices stock while it arrives. Products, downloaded '
+             'meanwhile, are read from disk once complete, so that each chunk '
+             'is filtered by the stock SKUs as soon as it is read.'
+    )
+    parser.add_argument(
+        '--segments',
+        dest='download_segments',
+        action='store',
+        default=4,
+        help='HTTP Range segments each CSV is downloaded in, with --download.',
+        type=builtins.int
+    )
+    parser.add_argument(
+        '--compress-csvs',
+        dest='download_compression',
+        action='store',
+        default=None,
+        choices=('gzip', 'zstd'),
+        help='Store the CSVs compressed, with --download.'
+    )
+    parser.add_argument(
+        '--compress-payloads',
+        dest='compress_payloads',
+        action='store_true',
+        help='Gzip product requests (Content-Encoding), the ones '
+             'of 1 KB or more, e.g. with long descriptions.'
+    )
+    parser.add_argument(
+        '--bulk-max-items',
+        dest='bulk_max_items',
+        action='store',
+        default=500,
+        help='Most products of a bulk request.',
+        type=builtins.int
+    )
+    parser.add_argument(
+        '--bulk-max-bytes',
+        dest='bulk_max_bytes',
+        action='store',
+        default=1_000_000,
+        help='Most bytes of a bulk request.',
+        type=builtins.int
+    )
+    parser.add_argument(
+        '--http-timeout',
+        dest='http_timeout',
+        action='store',
+        default=30.0,
+        help='Seconds to wait for an API response.',
+        type=builtins.float
+    )
+    parser.add_argument(
+        '--top-n',
+        dest='top_n',
+        action='store',
+        default=100,
+        help='How many of the most expensive products to ingest by branch.',
+        type=builtins.int
+    )
     parser.add_argument(
         '--branches',
         dest='branches',
@@ -144,7 +282,7 @@ def ingestion() -> None:
         nargs='+',
         default=['MM', 'RHSM'],
         help='Product branches.',
-        type=builtins.list
+        type=builtins.str
     )
     parser.add_argument(
         '--package-units',
@@ -153,7 +291,23 @@ def ingestion() -> None:
         nargs='+',
         default=['GR', 'ML', 'KG', 'GRS'],
         help='Package units to extract.',
-        type=builtins.list
+        type=builtins.str
+    )
+    parser.add_argument(
+        '--no-csv-cache',
+        dest='csv_cache',
+        action='store_false',
+        help='Always parse the CSVs instead of loading '
+             'the cached ones from the assets dir.'
+    )
+    parser.add_argument(
+        '--csv-chunksize',
+        dest='csv_chunksize',
+        action='store',
+        default=None,
+        help='Stream the CSVs by chunks of this many rows, filtering '
+             'them while reading instead of loading them whole.',
+        type=builtins.int
     )
     args = parser.parse_args()
     credential_file = args.credentials_file
@@ -168,5 +322,84 @@ def ingestion() -> None:
             url=args.url,
             items_batch=args.items_batch,
             product_branches=args.branches,
-            package_units=args.units
-        ).main()
\ No newline at end of file
+            package_units=args.units,
+            csv_cache=args.csv_cache,
+            csv_chunksize=args.csv_chunksize,
+            top_n=args.top_n,
+            http_timeout=args.http_timeout,
+            ingest_engine=args.ingest_engine,
+            max_items_batch=args.max_items_batch,
+            bulk_max_items=args.bulk_max_items,
+            bulk_max_bytes=args.bulk_max_bytes,
+            rate_limit=args.rate_limit,
+            rate_burst=args.rate_burst,
+            compress_payloads=args.compress_payloads,
+            download_csvs=args.download_csvs,
+            download_segments=args.download_segments,
+            download_compression=args.download_compression,
+            retries=args.retries,
+            dead_letter=args.dead_letter
+        ).main()
+
+def replay() -> None:
+    parser = argparse.ArgumentParser(
+        description='Send again the products that could not be ingested.'
+    )
+    parser.add_argument(
+        '--credentials-file',
+        dest='credentials_file',
+        default='.config.json',
+        type=builtins.str
+    )
+    parser.add_argument(
+        '--url',
+        dest='url',
+        action='store',
+        choices=['http://0.0.0.0:5000/', 'https://damp-mountain-80499.herokuapp.com/'],
+        default='https://damp-mountain-80499.herokuapp.com/',
+        help='Host to ingest products.',
+        type=builtins.str
+    )
+    parser.add_argument(
+        '--products-batch',
+        dest='items_batch',
+        action='store',
+        default=10,
+        help='How many to ingest simultaneously.',
+        type=builtins.int
+    )
+    parser.add_argument(
+        '--http-timeout',
+        dest='http_timeout',
+        action='store',
+        default=30.0,
+        help='Seconds to wait for an API response.',
+        type=builtins.float
+    )
+    parser.add_argument(
+        '--retries',
+        dest='retries',
+        action='store',
+        default=3,
+        type=builtins.int
+    )
+    parser.add_argument(
+        '--dead-letter',
+        dest='dead_letter',
+        action='store',
+        default=None,
+        help='Default: assets/failed_products.ndjson',
+        type=builtins.str
+    )
+    args = parser.parse_args()
+    credential_file = args.credentials_file
+    if not os.path.exists(pathlib.Path(__file__).parent.parent.joinpath(credential_file).resolve()):
+        raise ValueError('credentials file doesn\'t exist.')
+    replay_failed_products(
+        credentials_file=credential_file,
+        url=args.url,
+        items_batch=args.items_batch,
+        http_timeout=args.http_timeout,
+        retries=args.retries,
+        dead_letter=args.dead_letter
+    )
\ No newline at end of file
@@ -0,0 +1,81 @@
+""" Compressed assets: CSVs may be stored gzipped (`<csv>.gz`) or
+zstd compressed (`<csv>.zst`, which needs the `zstandard` package),
+trading CPU to decompress them for fewer bytes read from disk. Readers
+find them by the CSV path and tell the format by its magic bytes. """
+
+import builtins
+import gzip
+import os
+from typing import cast, Dict, IO, Optional
+
+try:
+    import zstandard  # type: ignore[import-not-found, import-untyped, unused-ignore]
+except ImportError:  # optional, only needed for zstd assets.
+    zstandard = None
+
+SUFFIXES: Dict[builtins.str, builtins.str] = {'gzip': '.gz', 'zstd': '.zst'}
+""" Compression formats and the suffix of the files stored in them. """
+
+_MAGIC = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+
+
+def check(compression: Optional[builtins.str]) -> None:
+    """ Raises if `compression` is not a format, or one that can't be used. """
+
+    if compression is not None and compression not in SUFFIXES:
+        raise ValueError(f'`compression` must be one of {tuple(SUFFIXES)} or None.')
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('zstd assets need the zstandard package: pip install cornershop[zstd]')
+
+
+def stored_path(csv_path: builtins.str, compression: Optional[builtins.str]) -> builtins.str:
+    """ Path `csv_path` is stored at, compressed as `compression`. """
+
+    check(compression)
+    return csv_path + SUFFIXES[compression] if compression else csv_path
+
+
+def resolve(csv_path: builtins.str) -> builtins.str:
+    """ The file `csv_path` is stored in: itself, or else its newest
+    compressed variant; `csv_path` when there is none. """
+
+    variants = [csv_path] + [csv_path + suffix for suffix in SUFFIXES.values()]
+    existing = [path for path in variants if os.path.exists(path)]
+    if not existing:
+        return csv_path
+
+    return max(existing, key=lambda path: os.stat(path).st_mtime_ns)
+
+
+def detect(path: builtins.str) -> Optional[builtins.str]:
+    """ Compression of the file at `path`, by its magic bytes. """
+
+    with open(path, 'rb') as f:
+        head = f.read(4)
+
+    return next((name for magic, name in _MAGIC.items() if head.startswith(magic)), None)
+
+
+def open_writer(fileobj: IO[builtins.bytes], compression: builtins.str) -> IO[builtins.bytes]:
+    """ Writable file object compressing into `fileobj`; closing it
+    finishes the compressed stream but leaves `fileobj` open. """
+
+    check(compression)
+    if compression == 'gzip':
+        # level 6 and no timestamp: the same CSV always compresses the same.
+        return cast(IO[builtins.bytes], gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6, mtime=0))
+
+    return cast(IO[builtins.bytes], zstandard.ZstdCompressor(level=3).stream_writer(fileobj, closefd=False))
+
+
+def open_reader(path: builtins.str) -> IO[builtins.bytes]:
+    """ Readable file object of the decompressed content of `path`. """
+
+    compression = detect(path)
+    check(compression)
+    if compression == 'gzip':
+        return cast(IO[builtins.bytes], gzip.open(path, 'rb'))
+    if compression == 'zstd':
+        return cast(IO[builtins.bytes], zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+
+    return open(path, 'rb')
@@ -0,0 +1,105 @@
+import builtins
+import threading
+from typing import List, Optional
+
+
+class AIMDController:
+    """ Additive increase, multiplicative decrease of how many product
+    requests are in flight.
+
+    Responses are judged by windows as large as the current concurrency:
+    a window with a throttled (429), server error (5xx) or failed
+    request, or whose p95 latency went over `latency_tolerance` times
+    the usual one, divides the concurrency by `1 / decrease`; any other
+    window adds `increase` to it. """
+
+    def __init__(
+            self,
+            initial: builtins.int,
+            *,
+            maximum: builtins.int,
+            minimum: builtins.int = 1,
+            increase: builtins.float = 1.0,
+            decrease: builtins.float = 0.5,
+            latency_tolerance: builtins.float = 2.0
+    ) -> None:
+
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self._limit = builtins.float(initial)
+        self._latencies: List[builtins.float] = []
+        self._errors = 0
+        self._usual_p95: Optional[builtins.float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def concurrency(self) -> builtins.int:
+        return max(self.minimum, builtins.int(self._limit))
+
+    def record(self, status: Optional[builtins.int], latency: builtins.float) -> None:
+        """ Takes a response status (None if the request failed)
+        and its latency in seconds. """
+
+        with self._lock:
+            self._latencies.append(latency)
+            if status is None or status == 429 or status >= 500:
+                self._errors += 1
+            if len(self._latencies) < self.concurrency:
+                return
+
+            latencies = sorted(self._latencies)
+            p95 = latencies[builtins.int(0.95 * (len(latencies) - 1))]
+            slow = self._usual_p95 is not None and p95 > self._usual_p95 * self.latency_tolerance
+            if self._errors or slow:
+                self._limit = max(builtins.float(self.minimum), self._limit * self.decrease)
+            else:
+                self._limit = min(builtins.float(self.maximum), self._limit + self.increase)
+                self._usual_p95 = p95 if self._usual_p95 is None else 0.8 * self._usual_p95 + 0.2 * p95
+            self._latencies = []
+            self._errors = 0
+
+
+class BatchSizer:
+    """ How many products, and how many bytes of them, go in a bulk
+    request. An accepted batch lets the next ones grow by
+    `max_items / 10` products, up to `max_items`; a batch too large for
+    the server (413) halves both limits below its own size, and one that
+    failed (timeouts, 5xx) halves the products limit. """
+
+    def __init__(
+            self,
+            max_items: builtins.int,
+            max_bytes: builtins.int,
+            *,
+            initial: Optional[builtins.int] = None
+    ) -> None:
+
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.items = min(initial or max_items, max_items)
+        self.bytes = max_bytes
+        self._step = max(1, max_items // 10)
+
+    def fits(self, items: builtins.int, size: builtins.int) -> builtins.bool:
+        """ Whether a batch of `items` products, `size` bytes long, is
+        within the limits. """
+
+        return items <= self.items and size <= self.bytes
+
+    def record(
+            self,
+            status: Optional[builtins.int],
+            items: builtins.int,
+            size: builtins.int
+    ) -> None:
+
+        if status == 200:
+            self.items = min(self.max_items, self.items + self._step)
+        elif status == 413:
+            self.items = max(1, min(self.items, items // 2))
+            self.bytes = max(1, min(self.bytes, size // 2))
+        elif status is None or status >= 500:
+            self.items = max(1, min(self.items, items // 2))
@@ -0,0 +1,252 @@
+""" On-disk caches, so a run does not redo the work of the previous ones.
+
+`CSVCache` keeps parsed CSVs, so PRODUCTS.csv and PRICES-STOCK.csv are
+not re-parsed when they did not change. Each cached CSV is two files
+inside the cache directory: the parsed DataFrame (pickled, which keeps
+pandas' columnar blocks as they are) and a small json manifest with the
+source file size, mtime and SHA-256.
+
+`TextMemo` keeps the results of string transforms, e.g. of descriptions.
+"""
+
+import builtins
+import hashlib
+import json
+import os
+import pickle
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+
+def _atomic_write(path: builtins.str, payload: builtins.bytes) -> None:
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def _file_sha256(path: builtins.str, chunk_size: builtins.int = 1 << 20) -> builtins.str:
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class CSVCache:
+
+    _VERSION = 1
+    _HASH_CHUNK = 1 << 20
+
+    def __init__(self, cache_dir: builtins.str) -> None:
+        self.cache_dir = cache_dir
+
+    def load(
+            self,
+            csv_path: builtins.str,
+            reader: Callable[[builtins.str], pd.DataFrame],
+            *,
+            key: builtins.str = ''
+    ) -> pd.DataFrame:
+        """ Returns the cached DataFrame of `csv_path` when its manifest
+        still matches the source file, otherwise parses it with `reader`
+        and (re)writes the cache entry. `key` tells apart entries of the
+        same file parsed differently (e.g. another schema). """
+
+        data_path, manifest_path = self._entry_paths(csv_path, key)
+        manifest = self._read_manifest(manifest_path)
+        stat = os.stat(csv_path)
+        if manifest is not None and self._is_fresh(csv_path, stat, manifest, manifest_path):
+            dataframe = self._read_data(data_path, manifest)
+            if dataframe is not None:
+                return dataframe
+
+        dataframe = reader(csv_path)
+        self._write(csv_path, stat, dataframe, data_path, manifest_path, key)
+        return dataframe
+
+    def _entry_paths(
+            self,
+            csv_path: builtins.str,
+            key: builtins.str
+    ) -> Tuple[builtins.str, builtins.str]:
+
+        name = os.path.basename(csv_path)
+        if key:
+            name = f'{name}.{hashlib.sha256(key.encode()).hexdigest()[:12]}'
+        base = os.path.join(self.cache_dir, name)
+        return f'{base}.pkl', f'{base}.json'
+
+    @staticmethod
+    def _read_manifest(manifest_path: builtins.str) -> Optional[Dict[builtins.str, Any]]:
+
+        try:
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_fresh(
+            self,
+            csv_path: builtins.str,
+            stat: os.stat_result,
+            manifest: Dict[builtins.str, Any],
+            manifest_path: builtins.str
+    ) -> builtins.bool:
+        """ Size and mtime are checked first; the content hash is only
+        recomputed when the mtime moved, so an untouched file costs a
+        stat() and a touched-but-equal file keeps its cache. """
+
+        if manifest.get('version') != self._VERSION or manifest.get('size') != stat.st_size:
+            return False
+        if manifest.get('mtime_ns') == stat.st_mtime_ns:
+            return True
+        if manifest.get('sha256') != self._sha256(csv_path):
+            return False
+
+        manifest['mtime_ns'] = stat.st_mtime_ns
+        _atomic_write(manifest_path, json.dumps(manifest).encode())
+        return True
+
+    def _read_data(
+            self,
+            data_path: builtins.str,
+            manifest: Dict[builtins.str, Any]
+    ) -> Optional[pd.DataFrame]:
+
+        try:
+            with open(data_path, 'rb') as f:
+                payload = f.read()
+        except OSError:
+            return None
+        # a truncated or tampered payload is treated as a miss.
+        if hashlib.sha256(payload).hexdigest() != manifest.get('data_sha256'):
+            return None
+        try:
+            dataframe = pickle.loads(payload)
+        except Exception:
+            return None
+
+        return dataframe if isinstance(dataframe, pd.DataFrame) else None
+
+    def _write(
+            self,
+            csv_path: builtins.str,
+            stat: os.stat_result,
+            dataframe: pd.DataFrame,
+            data_path: builtins.str,
+            manifest_path: builtins.str,
+            key: builtins.str
+    ) -> None:
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        payload = pickle.dumps(dataframe, protocol=pickle.HIGHEST_PROTOCOL)
+        manifest = {
+            'version': self._VERSION,
+            'source': os.path.basename(csv_path),
+            'key': key,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': self._sha256(csv_path),
+            'data_sha256': hashlib.sha256(payload).hexdigest(),
+        }
+        _atomic_write(data_path, payload)
+        _atomic_write(manifest_path, json.dumps(manifest).encode())
+
+    @classmethod
+    def _sha256(cls, path: builtins.str) -> builtins.str:
+        return _file_sha256(path, cls._HASH_CHUNK)
+
+
+class TextMemo:
+    """ Bounded memo persisted as a pickle: once over `max_entries`
+    entries or about `max_bytes` of values, the least recently used are
+    dropped. Keys are kept as 16 bytes digests, so long descriptions are
+    not stored twice. It is written by `save` only when entries were
+    added. A missing, corrupt or older file starts an empty memo. """
+
+    FORMAT = 2
+    """ Version of the persisted memo, bumped when its layout changes. """
+
+    def __init__(
+            self,
+            path: builtins.str,
+            max_entries: builtins.int = 200_000,
+            max_bytes: builtins.int = 64 << 20
+    ) -> None:
+
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[builtins.bytes, Any]' = self._load()
+        self._bytes = sum(self._size(value) for value in self._entries.values())
+        self._dirty = False
+
+    def __len__(self) -> builtins.int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+
+        digest = self._digest(key)
+        value = self._entries.get(digest)
+        if value is not None:
+            self._entries.move_to_end(digest)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+
+        digest = self._digest(key)
+        if digest in self._entries:
+            self._bytes -= self._size(self._entries[digest])
+        self._entries[digest] = value
+        self._entries.move_to_end(digest)
+        self._bytes += self._size(value)
+        while len(self._entries) > self.max_entries or (self._bytes > self.max_bytes and len(self._entries) > 1):
+            _, dropped = self._entries.popitem(last=False)
+            self._bytes -= self._size(dropped)
+        self._dirty = True
+
+    def save(self) -> None:
+
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        _atomic_write(
+            self.path,
+            pickle.dumps({'format': self.FORMAT, 'entries': self._entries}, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+        self._dirty = False
+
+    def _load(self) -> 'OrderedDict[builtins.bytes, Any]':
+
+        try:
+            with open(self.path, 'rb') as f:
+                memo = pickle.load(f)
+        except Exception:
+            return OrderedDict()
+
+        if not isinstance(memo, builtins.dict) or memo.get('format') != self.FORMAT \
+                or not isinstance(memo.get('entries'), OrderedDict):
+            return OrderedDict()
+        return memo['entries']
+
+    @staticmethod
+    def _digest(key: Hashable) -> builtins.bytes:
+
+        data = key.encode('utf-8', 'surrogatepass') if isinstance(key, builtins.str) else pickle.dumps(key)
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    @classmethod
+    def _size(cls, value: Any) -> builtins.int:
+        """ Rough bytes of `value`, counting its strings only. """
+
+        if isinstance(value, (builtins.str, builtins.bytes)):
+            return len(value) + 16
+        if isinstance(value, builtins.tuple):
+            return sum(cls._size(item) for item in value) + 16
+        return 16
@@ -1,9 +1,28 @@
 import abc
 import builtins
-from typing import Any, Dict, List, Optional
-
+import functools
+import hashlib
+import os
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Pattern, Tuple, Union
+
+import numpy as np
 import pandas as pd
 
+from . import compression
+from .csv_cache import CSVCache, TextMemo
+from .csv_schema import CSVSchema
+
+_HTML_TAGS = re.compile(r'<[^<>]*>')
+
+
+@functools.lru_cache(maxsize=None)
+def _package_regex(units: Tuple[builtins.str, ...]) -> Pattern:
+    """ Package info regex, compiled once per units list. """
+
+    return re.compile(rf'(?i)\b(\d+(?:\.\d+)?)\s*({"|".join(units).lower()})\b')
+
 
 class PandasOpsInterface(abc.ABC):
 
@@ -85,6 +104,29 @@ class PandasOpsInterface(abc.ABC):
 
         pass
 
+    @staticmethod
+    @abc.abstractmethod
+    def strip_html_and_extract_package(
+            dataframe: pd.DataFrame,
+            column: builtins.str,
+            units: List[builtins.str],
+            memo: Optional[TextMemo] = None
+    ) -> Tuple[pd.Series, pd.Series]:
+
+        pass
+
+    @staticmethod
+    @abc.abstractmethod
+    def top_n_by_group(
+            dataframe: pd.DataFrame,
+            group_column: builtins.str,
+            groups: List[builtins.str],
+            sort_by_column: builtins.str,
+            n: builtins.int
+    ) -> pd.DataFrame:
+
+        pass
+
     @staticmethod
     @abc.abstractmethod
     def nan_to_empty_str(
@@ -131,7 +173,7 @@ class PandasOperations(PandasOpsInterface):
     ) -> pd.DataFrame:
 
         return dataframe[
-            dataframe.groupby(group_by_columns)[apply_transform_into_col].
+            dataframe.groupby(group_by_columns, observed=True)[apply_transform_into_col].
                 transform(transform_op) == dataframe[apply_transform_into_col]
         ]
 
@@ -142,15 +184,35 @@ class PandasOperations(PandasOpsInterface):
             cols_to_concat: List[builtins.str],
             lower: builtins.bool = None
     ) -> pd.DataFrame:
+        """ Column-wise version of joining each row's values as strings:
+        every column is turned into strings through a lookup table of
+        its distinct values, then columns are concatenated as object
+        arrays. Lowering, when asked, runs once per distinct result. """
+
+        joined = np.full(len(dataframe), '', dtype=object)
+        for position, column in enumerate(cols_to_concat):
+            values = PandasOperations._values_as_str(dataframe[column])
+            joined = values if not position else joined + sep + values
 
         if lower:
-            return dataframe[cols_to_concat].apply(
-                lambda row: sep.join(
-                    row.values.astype(str)).lower(), axis=1)
+            codes, uniques = pd.factorize(joined)
+            joined = np.array([u.lower() for u in uniques], dtype=object)[codes]
 
-        return dataframe[cols_to_concat].apply(
-            lambda row: sep.join(row.values.astype(str)), axis=1)
+        return pd.Series(joined, index=dataframe.index, dtype=object)
 
+    @staticmethod
+    def _values_as_str(series: pd.Series) -> np.ndarray:
+        """ `str()` of every value, computed once per distinct value;
+        missing ones become 'nan' as `ndarray.astype(str)` does. """
+
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype('category')
+        # code -1 (missing) picks the trailing 'nan'.
+        table = np.array(
+            [builtins.str(c) for c in series.cat.categories] + ['nan'],
+            dtype=object
+        )
+        return table[series.cat.codes.to_numpy()]
 
     @staticmethod
     def drop_columns_values(
@@ -166,7 +228,7 @@ class PandasOperations(PandasOpsInterface):
             column: builtins.str,
     ) -> pd.DataFrame:
 
-        return dataframe[column].str.replace(r'<[^<>]*>', '', regex=True)
+        return dataframe[column].str.replace(_HTML_TAGS, '', regex=True)
 
     @staticmethod
     def extract_package_info(
@@ -175,7 +237,61 @@ class PandasOperations(PandasOpsInterface):
             units: List[builtins.str]
     ) -> pd.DataFrame:
 
-        return dataframe[column].str.extract(rf'(?i)\b(\d+(?:\.\d+)?)\s*({"|".join(units).lower()})\b', expand=False)
+        return dataframe[column].str.extract(_package_regex(tuple(units)), expand=False)
+
+    @staticmethod
+    def strip_html_and_extract_package(
+            dataframe: pd.DataFrame,
+            column: builtins.str,
+            units: List[builtins.str],
+            memo: Optional[TextMemo] = None
+    ) -> Tuple[pd.Series, pd.Series]:
+        """ `remove_html_tags` and `extract_package_info` in one pass:
+        returns the column without html tags and the package as
+        '<quantity> <unit>', empty string when there is none.
+
+        Descriptions repeat a lot across branches, so each distinct one
+        is processed once (or looked up in `memo`) and broadcast back. """
+
+        package_regex = _package_regex(tuple(units))
+        codes, uniques = pd.factorize(dataframe[column])
+        # one extra slot, picked by code -1 (missing value).
+        descriptions = np.empty(len(uniques) + 1, dtype=object)
+        descriptions[-1] = np.nan
+        packages = np.full(len(uniques) + 1, '', dtype=object)
+        for position, value in enumerate(uniques):
+            if not isinstance(value, builtins.str):
+                descriptions[position] = value
+                continue
+            result = memo.get(value) if memo is not None else None
+            if result is None:
+                description = _HTML_TAGS.sub('', value)
+                match = package_regex.search(description)
+                result = (description, f'{match.group(1)} {match.group(2)}' if match else '')
+                if memo is not None:
+                    memo[value] = result
+            descriptions[position], packages[position] = result
+
+        return (
+            pd.Series(descriptions[codes], index=dataframe.index, dtype=object),
+            pd.Series(packages[codes], index=dataframe.index, dtype=object)
+        )
+
+    @staticmethod
+    def top_n_by_group(
+            dataframe: pd.DataFrame,
+            group_column: builtins.str,
+            groups: List[builtins.str],
+            sort_by_column: builtins.str,
+            n: builtins.int
+    ) -> pd.DataFrame:
+        """ The `n` rows with largest `sort_by_column` of every one of
+        `groups`, in one grouped partial selection instead of one mask
+        plus a full sort by group. Rows come grouped, largest first. """
+
+        dataframe = dataframe[dataframe[group_column].isin(groups)]
+        top = dataframe.groupby(group_column, observed=True, sort=False)[sort_by_column].nlargest(n)
+        return dataframe.loc[top.index.get_level_values(-1)]
 
     @staticmethod
     def nan_to_empty_str(
@@ -194,16 +310,157 @@ class CSVOps:
             *,
             products_csv: builtins.str,
             price_stock_csv: builtins.str,
-            merchant_id: builtins.str
+            merchant_id: builtins.str,
+            cache_dir: Optional[builtins.str] = None,
+            chunksize: Optional[builtins.int] = None,
+            schema: Optional[CSVSchema] = None
     ) -> None:
 
         self._pandas_ops = pandas_ops_interface
+        self._cache = CSVCache(cache_dir) if cache_dir else None
+        self._schema = schema
+        self._products_csv = products_csv
+        self._price_stock_csv = price_stock_csv
+        self.chunksize = chunksize
         # suppress warnings.
         pd.set_option('mode.chained_assignment', None)
-        self.products = pd.read_csv(products_csv, sep='|')
-        self.stock = pd.read_csv(price_stock_csv, sep='|')
+        self.products: Optional[pd.DataFrame] = None
+        self.stock: Optional[pd.DataFrame] = None
+        if not self.chunksize:
+            # streaming mode reads them later, see `stream_filtered`.
+            self.products = self._read_csv(products_csv)
+            self.stock = self._read_csv(price_stock_csv)
         self.merchant_id = merchant_id
 
+    def _read_csv(self, csv_path: builtins.str) -> pd.DataFrame:
+
+        # the CSV may be stored compressed, see `compression`.
+        csv_path = compression.resolve(csv_path)
+        if self._cache is None:
+            return self._parse_csv(csv_path)
+
+        return self._cache.load(
+            csv_path,
+            self._parse_csv,
+            key=self._schema.fingerprint() if self._schema else ''
+        )
+
+    def _parse_csv(self, csv_path: builtins.str, **kwargs: Any) -> pd.DataFrame:
+
+        kwargs['compression'] = compression.detect(csv_path)
+        if self._schema is None:
+            return pd.read_csv(csv_path, sep='|', **kwargs)
+
+        return self._schema.compact(
+            pd.read_csv(csv_path, sep='|', **self._schema.read_csv_kwargs(), **kwargs)
+        )
+
+    def memory_report(self) -> Dict[builtins.str, Dict[builtins.str, Any]]:
+        """ Per column memory of both dataframes, see `CSVSchema.memory_report`. """
+
+        return {
+            'products': CSVSchema.memory_report(self.products),
+            'stock': CSVSchema.memory_report(self.stock),
+        }
+
+    def stream_filtered(
+            self,
+            *,
+            branch_column: builtins.str,
+            branches: List[builtins.str],
+            stock_column: builtins.str,
+            sku_column: builtins.str,
+            sources: Optional[Dict[builtins.str, BinaryIO]] = None
+    ) -> None:
+        """ Reads prices stock CSV by chunks keeping only the rows of
+        `branches` with stock greater than zero, then reads products CSV
+        by chunks keeping only the SKUs that survived. Peak memory is
+        then one chunk plus the filtered rows, not the whole files.
+
+        `sources` are file objects to read the CSVs from instead, by CSV
+        path, e.g. `IntegrationSetup.open_streams` pipes of CSVs being
+        downloaded. Prices stock is then read as its bytes arrive, and
+        products once prices stock SKUs are all known, so that each chunk
+        is filtered as soon as it is read. """
+
+        sources = sources or {}
+        skus: 'Future[pd.Index]' = Future()
+        stock_source = sources.get(self._price_stock_csv, self._price_stock_csv)
+        if not sources:
+            self._stream_stock(stock_source, branch_column, branches, stock_column, sku_column, skus)
+            products_chunks = self._stream_products(self._products_csv, sku_column, skus)
+        else:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                products = executor.submit(
+                    self._stream_products,
+                    sources.get(self._products_csv, self._products_csv),
+                    sku_column,
+                    skus
+                )
+                self._stream_stock(stock_source, branch_column, branches, stock_column, sku_column, skus)
+                products_chunks = products.result()
+        self.products = self._concat_chunks(products_chunks, self._products_csv)
+
+    def _stream_stock(
+            self,
+            source: Union[builtins.str, BinaryIO],
+            branch_column: builtins.str,
+            branches: List[builtins.str],
+            stock_column: builtins.str,
+            sku_column: builtins.str,
+            skus: 'Future[pd.Index]'
+    ) -> None:
+        """ Sets the filtered prices stock, then `skus` to its SKUs. """
+
+        try:
+            stock_chunks = []
+            for chunk in self._iter_csv_chunks(source):
+                chunk = chunk[self._pandas_ops.filter_by_branches(chunk, branch_column, branches)]
+                chunk = chunk[self._pandas_ops.filter_by_stock_greater_than_zero(chunk, stock_column)]
+                stock_chunks.append(chunk)
+            self.stock = self._concat_chunks(stock_chunks, self._price_stock_csv)
+        except BaseException as e:
+            # so products reading does not wait for SKUs forever.
+            skus.set_exception(e)
+            raise
+        skus.set_result(pd.Index(self.stock[sku_column].unique()))
+
+    def _stream_products(
+            self,
+            source: Union[builtins.str, BinaryIO],
+            sku_column: builtins.str,
+            skus: 'Future[pd.Index]'
+    ) -> List[pd.DataFrame]:
+        """ Products chunks of the SKUs `skus` will hold. """
+
+        # unfiltered chunks would add up to the whole file, so none is
+        # read before the SKUs are known; a pipe holds the bytes meanwhile.
+        kept = skus.result()
+        return [chunk[chunk[sku_column].isin(kept)] for chunk in self._iter_csv_chunks(source)]
+
+    def _iter_csv_chunks(self, source: Union[builtins.str, BinaryIO]) -> Iterator[pd.DataFrame]:
+
+        kwargs = self._schema.read_csv_kwargs() if self._schema else {}
+        if isinstance(source, builtins.str):
+            source = compression.resolve(source)
+            kwargs['compression'] = compression.detect(source)
+        with pd.read_csv(source, sep='|', chunksize=self.chunksize, **kwargs) as reader:
+            for chunk in reader:
+                yield chunk
+
+    def _concat_chunks(
+            self,
+            chunks: List[pd.DataFrame],
+            csv_path: builtins.str
+    ) -> pd.DataFrame:
+
+        if not chunks:
+            # a header-only CSV yields no chunk at all.
+            return self._parse_csv(compression.resolve(csv_path), nrows=0)
+
+        dataframe = pd.concat(chunks)
+        return self._schema.compact(dataframe) if self._schema else dataframe
+
     def filter_by_branch(
             self,
             column: builtins.str,
@@ -222,6 +479,7 @@ class CSVOps:
         if return_dataframe:
             return mask
 
+        assert self.stock is not None, 'prices stock has not been read yet.'
         self.stock = self.stock[mask]
 
     def filter_by_stock_greater_than_zero(
@@ -233,6 +491,7 @@ class CSVOps:
             self.stock,
             column
         )
+        assert self.stock is not None, 'prices stock has not been read yet.'
         self.stock = self.stock[mask]
 
     def dataframes_merge_on(self, key: builtins.str) -> pd.DataFrame:
@@ -297,6 +556,46 @@ class CSVOps:
 
         return self._pandas_ops.extract_package_info(dataframe, column, units)
 
+    def strip_html_and_extract_package(
+            self,
+            dataframe: pd.DataFrame,
+            column: builtins.str,
+            units: List[builtins.str]
+    ) -> Tuple[pd.Series, pd.Series]:
+
+        memo = self._descriptions_memo(units)
+        result = self._pandas_ops.strip_html_and_extract_package(dataframe, column, units, memo)
+        if memo is not None:
+            memo.save()
+        return result
+
+    def _descriptions_memo(self, units: List[builtins.str]) -> Optional[TextMemo]:
+        """ Memo of processed descriptions, kept in the cache dir. There is
+        one per units list, as the extracted package depends on it. """
+
+        if self._cache is None:
+            return None
+
+        key = hashlib.sha256('|'.join(units).lower().encode()).hexdigest()[:12]
+        return TextMemo(os.path.join(self._cache.cache_dir, f'descriptions.{key}.pkl'))
+
+    def top_n_by_group(
+            self,
+            dataframe: pd.DataFrame,
+            group_column: builtins.str,
+            groups: List[builtins.str],
+            sort_by_column: builtins.str,
+            n: builtins.int
+    ) -> pd.DataFrame:
+
+        return self._pandas_ops.top_n_by_group(
+            dataframe,
+            group_column,
+            groups,
+            sort_by_column,
+            n
+        )
+
     def nan_to_empty_str(
             self,
             dataframe: pd.DataFrame,
@@ -305,6 +604,27 @@ class CSVOps:
 
         self._pandas_ops.nan_to_empty_str(dataframe, column)
 
+    @staticmethod
+    def merge_branches(
+            *branches: Dict[builtins.str, Dict[builtins.str, Any]],
+            column: builtins.str
+    ) -> List[Dict[builtins.str, Any]]:
+        """ Merges any number of branches' items, keyed by SKU, into one
+        list with an item by SKU whose `column` (a list) holds the values
+        of every branch having it. Linear on the number of items and the
+        given items are left untouched. """
+
+        items: Dict[builtins.str, Dict[builtins.str, Any]] = {}
+        for branch in branches:
+            for sku, item in branch.items():
+                merged = items.get(sku)
+                if merged is None:
+                    items[sku] = {**item, column: list(item[column])}
+                else:
+                    merged[column].extend(item[column])
+
+        return list(items.values())
+
     @staticmethod
     def compare_branchs(
             branch_a: Dict[str, Any],
@@ -312,27 +632,6 @@ class CSVOps:
             *,
             column: builtins.str
     ) -> List[Dict[str, Any]]:
-        """ I devised this algorithm to compare the
-        top 100 most expensive products by branch (limited to 2) because
-        a product SKU could be in both branches, then,
-        both products would be merge into one. Nevertheless,
-        this functions returns such top products in one list. """
-
-        items = []
-        branch_b_copy = branch_b.copy()
-        for branch in branch_a:
-            count_equals = 0
-            for branch_ in branch_b:
-                if branch_ == branch:
-                    branch_a[branch][column] = branch_a[branch][column] + branch_b[branch_][column]
-                    items.append(branch_a[branch])
-                    branch_b_copy.pop(branch_)
-                    count_equals += 1
-            else:
-                if not count_equals:
-                    items.append(branch_a[branch])
-        else:
-            for branch in branch_b_copy.values():
-                items.append(branch)
+        """ Two branches `merge_branches`, kept for its callers. """
 
-        return items
+        return CSVOps.merge_branches(branch_a, branch_b, column=column)
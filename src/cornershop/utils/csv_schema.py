@@ -0,0 +1,108 @@
+""" Declarative schema of the CSVs columns: which ones are loaded
+and which compact dtype each one gets. """
+
+import builtins
+import hashlib
+import json
+import sys
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+class CSVSchema:
+
+    def __init__(
+            self,
+            *,
+            categories: Sequence[builtins.str] = (),
+            integers: Sequence[builtins.str] = (),
+            floats: Sequence[builtins.str] = (),
+            others: Sequence[builtins.str] = (),
+            float_dtype: builtins.str = 'float64'
+    ) -> None:
+
+        self.categories = list(categories)
+        self.integers = list(integers)
+        self.floats = list(floats)
+        self.others = list(others)
+        self.float_dtype = float_dtype
+
+    @property
+    def columns(self) -> List[builtins.str]:
+        return self.categories + self.integers + self.floats + self.others
+
+    def fingerprint(self) -> builtins.str:
+        """ Identifies the schema, e.g. as a cache key. """
+
+        return hashlib.sha256(
+            json.dumps(self.__dict__, sort_keys=True).encode()
+        ).hexdigest()
+
+    def read_csv_kwargs(self) -> Dict[builtins.str, Any]:
+        """ `pd.read_csv` keyword arguments: only the schema columns
+        present in the file are parsed, categories and floats already
+        in their compact dtype. Integers are downcast by `compact`
+        as their range is only known after parsing. """
+
+        usecols = set(self.columns)
+        dtype = {c: 'category' for c in self.categories}
+        dtype.update({c: self.float_dtype for c in self.floats})
+        return {'usecols': lambda c: c in usecols, 'dtype': dtype}
+
+    def compact(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """ Applies the compact dtypes in place. It is idempotent, so it can
+        be run again over concatenated chunks, whose categories are lost
+        when chunks do not share the same ones. """
+
+        for column in self.categories:
+            if column in dataframe and not isinstance(dataframe[column].dtype, pd.CategoricalDtype):
+                dataframe[column] = dataframe[column].astype('category')
+        for column in self.integers:
+            if column in dataframe:
+                dataframe[column] = pd.to_numeric(dataframe[column], downcast='integer')
+        for column in self.floats:
+            if column in dataframe and dataframe[column].dtype != self.float_dtype:
+                dataframe[column] = dataframe[column].astype(self.float_dtype)
+
+        return dataframe
+
+    def widen_floats(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """ Returns `dataframe` with its float columns as float64, e.g.
+        before serializing them. Floats are float64 unless the schema says
+        otherwise: a narrower `float_dtype` loses digits (float32 keeps
+        about 7, so prices of 131072 or more are rounded to cents no more),
+        which widening cannot bring back. """
+
+        widened = {
+            column: dataframe[column].astype(np.float64)
+            for column in self.floats if column in dataframe and dataframe[column].dtype != np.float64
+        }
+        return dataframe.assign(**widened) if widened else dataframe
+
+    @staticmethod
+    def memory_report(dataframe: pd.DataFrame) -> Dict[builtins.str, Dict[builtins.str, builtins.int]]:
+        """ Bytes taken by each column as loaded against what the default
+        inferred dtype (object for strings, 64 bits for numbers) takes. """
+
+        report = {}
+        for column in dataframe.columns:
+            series = dataframe[column]
+            compact = builtins.int(series.memory_usage(deep=True, index=False))
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                codes = series.cat.codes.to_numpy()
+                counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+                sizes = np.fromiter(
+                    (sys.getsizeof(v) for v in series.cat.categories),
+                    dtype=np.int64,
+                    count=len(series.cat.categories)
+                )
+                inferred = 8 * len(series) + builtins.int(counts @ sizes)
+            elif series.dtype.kind in 'iuf':
+                inferred = 8 * len(series)
+            else:
+                inferred = compact
+            report[column] = {'inferred': inferred, 'compact': compact, 'saved': inferred - compact}
+
+        return report
@@ -0,0 +1,56 @@
+""" Products that could not be ingested, one json per line, so they
+can be re-sent later without running the CSVs pipeline again. """
+
+import builtins
+import datetime
+import json
+import os
+from typing import Any, Dict, Iterator, Optional
+
+
+class DeadLetter:
+
+    def __init__(self, path: builtins.str) -> None:
+        self.path = path
+
+    def append(self, item: Dict[builtins.str, Any], status: Optional[builtins.int]) -> None:
+        """ Safe from many threads and processes at once: each line is
+        written by a single `write` on a file opened for appending. """
+
+        line = json.dumps({
+            'failed_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'status': status,
+            'item': item,
+        }, separators=(',', ':')) + '\n'
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    def take(self) -> Optional[builtins.str]:
+        """ Moves the current file aside, so items failing again while
+        replaying it are appended to a new one. Returns its new path,
+        None when there is nothing to replay. """
+
+        if not os.path.exists(self.path):
+            return None
+        taken = f'{self.path}.replaying'
+        if os.path.exists(taken):
+            # a previous replay did not finish, its items go first.
+            with open(taken, 'ab') as dst, open(self.path, 'rb') as src:
+                dst.write(src.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, taken)
+
+        return taken
+
+    @staticmethod
+    def items(path: builtins.str) -> Iterator[Dict[builtins.str, Any]]:
+
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)['item']
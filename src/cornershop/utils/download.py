@@ -0,0 +1,619 @@
+""" Assets downloads, split in HTTP Range segments fetched in parallel.
+
+A download is written into `<path>.part`, each segment at its own
+offset, and renamed to `<path>` once complete. Next to it, a small json
+(`<path>.part.json`) records how far each segment got, as of the last
+checkpoint (the data before it is flushed to disk first), so a dropped
+download resumes from there on the next run instead of from zero.
+
+Downloads are verified as they are written: bytes are counted and
+hashed on their way to disk (see `_StreamDigest`), then checked against
+the announced size and any checksum the server publishes.
+
+Those in order bytes can be teed into a `sink` as well, e.g. a
+`StreamPipe` a CSV parser reads while the download goes on.
+
+Files can be stored compressed (see `compression`): the in order
+bytes are then compressed as they come, into the file that replaces
+the old one, while `.part` keeps the raw bytes for resuming.
+
+An `AssetManifest` keeps the ETag, Last-Modified, size and SHA-256 of
+every downloaded file, so the next downloads are conditional requests
+that leave unchanged files alone. """
+
+import base64
+import binascii
+import builtins
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import requests
+
+from . import compression as compression_
+from .csv_cache import _atomic_write, _file_sha256
+
+@dataclass
+class Segment:
+    """ Bytes of a file fetched by one request. """
+
+    start: builtins.int
+    end: Optional[builtins.int]
+    """ Last byte, None until known when the server has no Range support. """
+    offset: builtins.int
+    """ Next byte to fetch. """
+
+    @property
+    def done(self) -> builtins.bool:
+        return self.end is not None and self.offset > self.end
+
+    def to_list(self) -> List[Optional[builtins.int]]:
+        """ As it is checkpointed, see `Segment.from_list`. """
+
+        return [self.start, self.end, self.offset]
+
+    @classmethod
+    def from_list(cls, values: List[Optional[builtins.int]]) -> 'Segment':
+
+        start, end, offset = values
+        if start is None or offset is None:
+            raise ValueError(f'Not a segment: {values}.')
+        return cls(start, end, offset)
+
+
+class AssetManifest:
+    """ What is known of each downloaded file, by file name, in a json
+    file. Downloads of many files at once share it. """
+
+    def __init__(self, path: builtins.str) -> None:
+
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self._entries: Dict[builtins.str, Dict[builtins.str, Any]] = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, path: builtins.str) -> Optional[Dict[builtins.str, Any]]:
+        return self._entries.get(os.path.basename(path))
+
+    def put(self, path: builtins.str, entry: Dict[builtins.str, Any]) -> None:
+
+        with self._lock:
+            self._entries[os.path.basename(path)] = entry
+            _atomic_write(self.path, json.dumps(self._entries, indent=2).encode())
+
+
+class _StreamDigest:
+    """ SHA-256 (and MD5, when there is one to check) of a file being
+    written in segments, in file order: bytes are hashed as they are
+    written when they are the next ones, while segments written ahead
+    are read back, from the page cache, once the bytes before them are
+    hashed. The file is never read whole. The same bytes, in the same
+    order, are given to `sink`. """
+
+    _READ_CHUNK = 1 << 20
+
+    def __init__(
+            self,
+            fd: builtins.int,
+            *,
+            md5: builtins.bool = False,
+            sink: Optional[Callable[[builtins.bytes], object]] = None
+    ) -> None:
+
+        self.offset = 0
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5() if md5 else None
+        self.sink = sink
+        self._fd = fd
+
+    def update(
+            self,
+            data: builtins.bytes,
+            offset: builtins.int,
+            segments: List[Segment],
+            limit: Optional[builtins.int] = None
+    ) -> None:
+        """ Takes `data` just written at `offset`, then reads back up to
+        `limit` bytes written ahead (all of them when None). """
+
+        if offset == self.offset:
+            self._hash(data)
+        self.catch_up(segments, limit)
+
+    def catch_up(self, segments: List[Segment], limit: Optional[builtins.int] = None) -> None:
+
+        read = 0
+        while limit is None or read < limit:
+            written_to = next((s.offset for s in segments if s.start <= self.offset < s.offset), self.offset)
+            if written_to <= self.offset:
+                return
+            data = os.pread(self._fd, min(written_to - self.offset, self._READ_CHUNK), self.offset)
+            self._hash(data)
+            read += len(data)
+
+    def _hash(self, data: builtins.bytes) -> None:
+
+        self.sha256.update(data)
+        if self.md5 is not None:
+            self.md5.update(data)
+        if self.sink is not None:
+            self.sink(data)
+        self.offset += len(data)
+
+
+@dataclass
+class _Progress:
+    """ Where a download is at, shared by its segments. """
+
+    digest: _StreamDigest
+    fetched: builtins.int = 0
+    checkpointed: builtins.int = 0
+    """ `fetched` as of the last checkpoint. """
+    drawn_at: builtins.float = 0.0
+    """ `time.monotonic()` the progress bar was last drawn at. """
+
+
+class StreamPipe(io.RawIOBase):
+    """ Read-only file object of bytes written into it by another
+    thread, e.g. a `Downloader` sink, for `pd.read_csv` to parse them as
+    they come. At most `max_buffered` bytes wait to be read: past that,
+    writing blocks, which slows the download down to the parsing pace. """
+
+    def __init__(self, max_buffered: builtins.int = 64 << 20) -> None:
+
+        super().__init__()
+        self._chunks: 'queue.Queue[Optional[builtins.bytes]]' = queue.Queue(
+            maxsize=max(1, max_buffered // (1 << 16))
+        )
+        self._pending = memoryview(b'')
+        self._error: Optional[BaseException] = None
+        self._finished = False
+
+    def readable(self) -> builtins.bool:
+        return True
+
+    def write(self, data: builtins.bytes) -> builtins.int:  # type: ignore[override]
+
+        for start in range(0, len(data), 1 << 16):
+            self._chunks.put(data[start:start + (1 << 16)])
+        return len(data)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """ Ends the stream, making the reader raise `error` if given. """
+
+        self._error = error
+        self._chunks.put(None)
+
+    def readinto(self, buffer: Any) -> builtins.int:
+
+        if not self._pending:
+            if self._finished:
+                return 0
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._finished = True
+                if self._error is not None:
+                    raise IOError(f'the stream has been cut: {self._error!r}') from self._error
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class Downloader:
+
+    def __init__(
+            self,
+            *,
+            segments: builtins.int = 4,
+            min_segment_size: builtins.int = 1 << 20,
+            chunk_size: builtins.int = 1 << 16,
+            checkpoint_size: builtins.int = 8 << 20,
+            timeout: Tuple[builtins.float, builtins.float] = (5.0, 60.0),
+            retries: builtins.int = 3,
+            progress_interval: builtins.float = 0.5,
+            compression: Optional[builtins.str] = None,
+            logger: Optional[logging.Logger] = None
+    ) -> None:
+
+        compression_.check(compression)
+
+        self.segments = max(1, segments)
+        self.min_segment_size = min_segment_size
+        self.chunk_size = chunk_size
+        self.checkpoint_size = checkpoint_size
+        self.timeout = timeout
+        self.retries = retries
+        self.progress_interval = progress_interval
+        self.compression = compression
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+    def download(
+            self,
+            url: builtins.str,
+            path: builtins.str,
+            manifest: Optional[AssetManifest] = None,
+            sink: Optional[Callable[[builtins.bytes], object]] = None
+    ) -> builtins.bool:
+        """ Downloads `url` into `path`, resuming a previous partial
+        download of the same remote file. With a `manifest`, an intact
+        `path` the server says is unchanged is kept as it is. `sink`
+        gets the whole file, in order, as it is downloaded (or read, if
+        unchanged). With `compression`, `path` is stored compressed, but
+        `sink` still gets its content. Returns whether `path` is complete
+        and up to date. """
+
+        entry = manifest.get(path) if manifest else None
+        remote = self._probe(url, self._conditional_headers(url, path, entry))
+        if remote['unchanged']:
+            self.logger.info(f'{path} is up to date.')
+            if sink is not None:
+                with compression_.open_reader(path) as f:
+                    for block in iter(lambda: f.read(self.chunk_size), b''):
+                        sink(block)
+            return True
+
+        part = f'{path}.part'
+        state = self._resume_state(path, url, remote)
+        if state is None:
+            state = {'url': url, **remote, 'segments': self._split(remote)}
+            with open(part, 'wb') as f:
+                if remote['size']:
+                    f.truncate(remote['size'])
+        else:
+            self.logger.info(f'Resuming {path} from {self._fetched(state)} bytes.')
+        self.logger.info(json.dumps({
+            'csv name': path,
+            'csv size (MB)': (remote['size'] or 0) / (1024 * 1000),
+            'segments': len(state['segments'])
+        }))
+
+        stored = open(f'{path}.tmp', 'wb') if self.compression else None
+        writer = compression_.open_writer(stored, self.compression) if stored and self.compression else None
+        sinks = [write for write in (writer.write if writer else None, sink) if write is not None]
+
+        def tee(data: builtins.bytes) -> None:
+            for write in sinks:
+                write(data)
+
+        fd = os.open(part, os.O_RDWR)
+        progress = _Progress(
+            digest=_StreamDigest(fd, md5='md5' in remote['checksums'], sink=tee if sinks else None),
+            fetched=self._fetched(state)
+        )
+        try:
+            pending = [segment for segment in state['segments'] if not segment.done]
+            with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+                results = list(executor.map(
+                    lambda segment: self._fetch_segment(url, fd, segment, state, progress, path),
+                    pending
+                ))
+            os.fsync(fd)
+            # bytes kept from a previous run, or written ahead of a failed segment.
+            progress.digest.catch_up(state['segments'])
+        finally:
+            os.close(fd)
+            if writer is not None and stored is not None:
+                writer.close()
+                stored.close()
+        self._draw(progress, state, force=True)
+
+        if state.get('changed'):
+            # the remote file changed meanwhile, so its parts do not fit together.
+            self.logger.error(f'{url} changed while downloading {path}, it must be downloaded again.')
+            self._discard(path)
+            return False
+        if not all(results) or (remote['size'] is not None and self._fetched(state) != remote['size']):
+            self._remove(f'{path}.tmp')
+            if state['ranges']:
+                self._save_state(path, state)
+                self.logger.error(f'{path} is not complete, it will be resumed on the next run.')
+            else:
+                self._discard(path)
+                self.logger.error(f'{path} is not complete.')
+            return False
+        digest = progress.digest
+        mismatches = [
+            name for name, expected in remote['checksums'].items()
+            if getattr(digest, name).hexdigest() != expected
+        ]
+        if mismatches:
+            self.logger.error(f'{path} does not match the published {", ".join(mismatches)}, it has been discarded.')
+            self._discard(path)
+            return False
+
+        # the complete file replaces the old one at once, never half written.
+        if self.compression:
+            os.replace(f'{path}.tmp', path)
+            self._remove(part)
+        else:
+            os.replace(part, path)
+        self._remove(self._state_path(path))
+        if manifest:
+            manifest.put(path, self._manifest_entry(url, path, remote, digest.sha256.hexdigest()))
+        return True
+
+    def _conditional_headers(
+            self,
+            url: builtins.str,
+            path: builtins.str,
+            entry: Optional[Dict[builtins.str, Any]]
+    ) -> Dict[builtins.str, builtins.str]:
+        """ Validators of the local `path`, none when it is missing or
+        is not what was downloaded. """
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return {}
+        if entry is None:
+            # unknown file, e.g. left truncated by a run before there was
+            # a manifest: it is newer than the remote one, so it can't be
+            # trusted on its date.
+            return {}
+        if entry.get('url') != url or entry.get('size') != stat.st_size \
+                or entry.get('compression') != self.compression:
+            return {}
+        if entry.get('mtime_ns') != stat.st_mtime_ns and entry.get('sha256') != _file_sha256(path):
+            return {}
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _manifest_entry(
+            self,
+            url: builtins.str,
+            path: builtins.str,
+            remote: Dict[builtins.str, Any],
+            content_sha256: builtins.str
+    ) -> Dict[builtins.str, Any]:
+        """ `sha256` and `size` are of the file as stored, `content_sha256`
+        of its content, which differ when it is compressed. """
+
+        stat = os.stat(path)
+        return {
+            'url': url,
+            'etag': remote['etag'],
+            'last_modified': remote['last_modified'],
+            'compression': self.compression,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': _file_sha256(path) if self.compression else content_sha256,
+            'content_sha256': content_sha256,
+        }
+
+    def _probe(
+            self,
+            url: builtins.str,
+            conditional_headers: Optional[Dict[builtins.str, builtins.str]] = None
+    ) -> Dict[builtins.str, Any]:
+        """ Size, Range support and validators of the remote file, and
+        whether it is unchanged since `conditional_headers`. """
+
+        remote: Dict[builtins.str, Any] = {
+            'size': None, 'ranges': False, 'etag': None, 'last_modified': None, 'unchanged': False, 'checksums': {}
+        }
+        try:
+            r = requests.head(url, headers=conditional_headers, allow_redirects=True, timeout=self.timeout)
+        except requests.RequestException:
+            return remote
+        remote['etag'] = r.headers.get('etag')
+        remote['last_modified'] = r.headers.get('last-modified')
+        if r.status_code == 304:
+            remote['unchanged'] = True
+            return remote
+        if not r.ok:
+            return remote
+
+        length = r.headers.get('content-length')
+        remote['size'] = builtins.int(length) if length and length.isdigit() else None
+        remote['ranges'] = r.headers.get('accept-ranges', '').lower() == 'bytes' and bool(remote['size'])
+        remote['checksums'] = self._published_checksums(r.headers)
+        return remote
+
+    @staticmethod
+    def _published_checksums(headers: Mapping[builtins.str, builtins.str]) -> Dict[builtins.str, builtins.str]:
+        """ Hex SHA-256 and MD5 the server publishes of the file: S3's
+        `x-amz-checksum-sha256`, `Digest`, `Content-MD5`, or an S3 ETag,
+        which is the MD5 of files not uploaded in parts. """
+
+        encoded: Dict[builtins.str, Optional[builtins.str]] = {
+            'sha256': headers.get('x-amz-checksum-sha256'),
+            'md5': headers.get('content-md5'),
+        }
+        for digest in (headers.get('digest') or '').split(','):
+            algorithm, _, value = digest.strip().partition('=')
+            if algorithm.lower() in ('sha-256', 'md5'):
+                encoded[algorithm.lower().replace('-', '')] = value
+
+        checksums = {}
+        for name, encoded_value in encoded.items():
+            if encoded_value:
+                try:
+                    checksums[name] = base64.b64decode(encoded_value, validate=True).hex()
+                except (binascii.Error, ValueError):
+                    pass
+        etag = (headers.get('etag') or '').strip('"')
+        if 'md5' not in checksums and re.fullmatch(r'[0-9a-f]{32}', etag):
+            checksums['md5'] = etag
+
+        return checksums
+
+    def _split(self, remote: Dict[builtins.str, Any]) -> List[Segment]:
+
+        size = remote['size']
+        if not remote['ranges']:
+            return [Segment(0, size - 1 if size else None, 0)]
+
+        count = max(1, min(self.segments, size // self.min_segment_size))
+        bounds = [size * n // count for n in range(count + 1)]
+        return [Segment(start, end - 1, start) for start, end in zip(bounds, bounds[1:])]
+
+    def _fetch_segment(
+            self,
+            url: builtins.str,
+            fd: builtins.int,
+            segment: Segment,
+            state: Dict[builtins.str, Any],
+            progress: _Progress,
+            path: builtins.str
+    ) -> builtins.bool:
+        """ Fetches what is left of `segment`, retrying from where a
+        dropped connection left it. """
+
+        for attempt in range(self.retries + 1):
+            headers = {}
+            if state['ranges']:
+                headers['Range'] = f'bytes={segment.offset}-{segment.end}'
+                validator = state['etag'] or state['last_modified']
+                if validator:
+                    headers['If-Range'] = validator
+            else:
+                # without ranges, a retry starts over.
+                digest = progress.digest
+                if digest.sink is not None and digest.offset:
+                    # what the sink got cannot be taken back.
+                    return False
+                with self._lock:
+                    progress.fetched -= segment.offset - segment.start
+                    progress.digest = _StreamDigest(fd, md5=digest.md5 is not None, sink=digest.sink)
+                segment.offset = segment.start
+            try:
+                with requests.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+                    r.raise_for_status()
+                    if state['ranges'] and r.status_code != 206:
+                        state['changed'] = True
+                        return False
+                    for chunk in r.iter_content(chunk_size=self.chunk_size):
+                        if segment.end is not None:
+                            chunk = chunk[:segment.end + 1 - segment.offset]
+                        os.pwrite(fd, chunk, segment.offset)
+                        segment.offset += len(chunk)
+                        self._progress(chunk, segment.offset - len(chunk), fd, state, progress, path)
+                        if segment.done:
+                            break
+                if segment.end is None:
+                    segment.end = segment.offset - 1
+                if segment.done:
+                    return True
+            except requests.RequestException as e:
+                self.logger.warning(
+                    f'{path} bytes {segment.offset}-{segment.end} failed ({e!r}), '
+                    f'attempt {attempt + 1} of {self.retries + 1}.'
+                )
+
+        return False
+
+    def _progress(
+            self,
+            chunk: builtins.bytes,
+            offset: builtins.int,
+            fd: builtins.int,
+            state: Dict[builtins.str, Any],
+            progress: _Progress,
+            path: builtins.str
+    ) -> None:
+        """ Counts and hashes `chunk`, just written at `offset`. """
+
+        with self._lock:
+            progress.fetched += len(chunk)
+            # reading back is spread over the writes, a few chunks at a time.
+            progress.digest.update(chunk, offset, state['segments'], limit=4 * len(chunk))
+            self._draw(progress, state)
+            if state['ranges'] and progress.fetched - progress.checkpointed >= self.checkpoint_size:
+                # offsets are taken before the flush, so they never run ahead of the disk.
+                snapshot = {**state, 'segments': [Segment(**vars(segment)) for segment in state['segments']]}
+                os.fsync(fd)
+                self._save_state(path, snapshot)
+                progress.checkpointed = progress.fetched
+
+    def _draw(
+            self,
+            progress: _Progress,
+            state: Dict[builtins.str, Any],
+            *,
+            force: builtins.bool = False
+    ) -> None:
+        """ Progress bar, redrawn every `progress_interval` seconds at
+        most, so the terminal does not slow the download down. """
+
+        now = time.monotonic()
+        if not state['size'] or (not force and now - progress.drawn_at < self.progress_interval):
+            return
+        progress.drawn_at = now
+        bar = builtins.int(25 * progress.fetched / state['size'])
+        sys.stdout.write('\r[%s%s]' % ('=' * bar, ' ' * (25 - bar)))
+        sys.stdout.flush()
+
+    def _resume_state(
+            self,
+            path: builtins.str,
+            url: builtins.str,
+            remote: Dict[builtins.str, Any]
+    ) -> Optional[Dict[builtins.str, Any]]:
+        """ Progress of a previous download of this very remote file,
+        whose `.part` file is still there. """
+
+        try:
+            with open(self._state_path(path), 'r') as f:
+                state: Dict[builtins.str, Any] = json.load(f)
+            state['segments'] = [Segment.from_list(values) for values in state['segments']]
+        except (OSError, ValueError, TypeError, KeyError):
+            self._discard(path)
+            return None
+
+        same_remote = state.get('url') == url and remote['ranges'] and state.get('ranges') \
+            and state.get('size') == remote['size'] \
+            and (state.get('etag'), state.get('last_modified')) == (remote['etag'], remote['last_modified'])
+        if not same_remote or not os.path.exists(f'{path}.part'):
+            self._discard(path)
+            return None
+
+        return state
+
+    @staticmethod
+    def _fetched(state: Dict[builtins.str, Any]) -> builtins.int:
+        return builtins.sum(segment.offset - segment.start for segment in state['segments'])
+
+    @staticmethod
+    def _state_path(path: builtins.str) -> builtins.str:
+        return f'{path}.part.json'
+
+    def _save_state(self, path: builtins.str, state: Dict[builtins.str, Any]) -> None:
+
+        saved = {**state, 'segments': [segment.to_list() for segment in state['segments']]}
+        _atomic_write(self._state_path(path), json.dumps(saved).encode())
+
+    def _discard(self, path: builtins.str) -> None:
+
+        self._remove(f'{path}.part')
+        self._remove(f'{path}.tmp')
+        self._remove(self._state_path(path))
+
+    @staticmethod
+    def _remove(path: builtins.str) -> None:
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,6 +1,9 @@
 import builtins
 from dataclasses import dataclass
-from typing import Dict, List, Union
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
 
 
 @dataclass
@@ -43,6 +46,7 @@ class IngestItem:
         if not all([
             isinstance(self.merchant_id, builtins.str),
             isinstance(self.sku, builtins.str),
+            isinstance(self.brand, builtins.str),
             isinstance(self.name, builtins.str),
             isinstance(self.description, builtins.str),
             isinstance(self.package, builtins.str),
@@ -56,3 +60,95 @@ class IngestItem:
                 'package, image_url, category, url` properties '
                 'must be strings.'
             )
+
+
+_BULK_FIELDS = (
+    'sku', 'barcodes', 'brand', 'name', 'description', 'package',
+    'image_url', 'category', 'url', 'branch', 'price', 'stock'
+)
+""" `validate_ingest_items` columns, in the order items are built. """
+
+
+def _is_str(series: pd.Series) -> np.ndarray:
+
+    values = series.to_numpy(dtype=object)
+    # fast path, when every present value is a string.
+    if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+        return ~pd.isna(values)
+
+    return np.fromiter((isinstance(v, builtins.str) for v in values), dtype=builtins.bool, count=len(values))
+
+
+def _is_number(series: pd.Series) -> np.ndarray:
+
+    if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+        return np.zeros(len(series), dtype=builtins.bool)
+
+    return series.notna().to_numpy()
+
+
+def validate_ingest_items(
+        dataframe: pd.DataFrame,
+        *,
+        merchant_id: builtins.str,
+        columns: Dict[builtins.str, builtins.str]
+) -> Tuple[List[Dict[builtins.str, Any]], pd.DataFrame]:
+    """ Column-wise `IngestItem` validation of a whole dataframe.
+
+    `columns` maps each `IngestItem` field (but merchant_id and
+    branch_products) plus branch, price and stock to its column.
+    Returns the valid items, as `IngestItem.__dict__` would be, and
+    the rejected rows, with the failed fields joined in `reason`. """
+
+    if not isinstance(merchant_id, builtins.str):
+        raise ValueError('`merchant_id` property must be a string.')
+
+    barcodes = dataframe[columns['barcodes']]
+    checks = {
+        # barcodes are turned into strings; as `str()` of a missing
+        # one would be 'nan', it must be present.
+        'barcodes': (barcodes.notna() & (barcodes.astype(builtins.str).str.len() > 0)).to_numpy(),
+        'branch': _is_str(dataframe[columns['branch']]),
+        'price': _is_number(dataframe[columns['price']]),
+        'stock': _is_number(dataframe[columns['stock']]),
+    }
+    for field in ('brand', 'name', 'description', 'package', 'image_url', 'category', 'url'):
+        checks[field] = _is_str(dataframe[columns[field]])
+
+    # one bit by failed check, so reasons are built once by combination.
+    failures = np.zeros(len(dataframe), dtype=np.int64)
+    for bit, passed in enumerate(checks.values()):
+        failures |= (~passed).astype(np.int64) << bit
+    valid = failures == 0
+    rejected = dataframe[~valid].copy()
+    codes, combinations = pd.factorize(failures[~valid])
+    reasons = np.array([
+        ', '.join(field for bit, field in enumerate(checks) if combination >> bit & 1)
+        for combination in combinations
+    ], dtype=object)
+    rejected['reason'] = reasons[codes]
+
+    accepted = dataframe[valid]
+    values = {
+        field: accepted[column].tolist() for field, column in columns.items()
+    }
+    items = [
+        {
+            'merchant_id': merchant_id,
+            'sku': builtins.str(sku),
+            'barcodes': [builtins.str(barcode)],
+            'brand': brand,
+            'name': name,
+            'description': description,
+            'package': package,
+            'image_url': image_url,
+            'category': category,
+            'url': url,
+            'branch_products': [{'branch': branch, 'price': price, 'stock': stock}]
+        }
+        for sku, barcode, brand, name, description, package, image_url, category, url, branch, price, stock in zip(
+            *(values[field] for field in _BULK_FIELDS)
+        )
+    ]
+
+    return items, rejected
@@ -0,0 +1,71 @@
+""" Products serialized once, right after validation, so senders (and
+worker processes, which get them pickled) handle bytes instead of
+dicts to encode again on every request. """
+
+import builtins
+import gzip
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+
+@dataclass(frozen=True)
+class ProductPayload:
+
+    sku: builtins.str
+    data: builtins.bytes
+    encoding: Optional[builtins.str] = None
+    """ `Content-Encoding` of `data`, None for plain JSON. """
+
+    @property
+    def headers(self) -> Dict[builtins.str, builtins.str]:
+
+        headers = {'Content-Type': 'application/json'}
+        if self.encoding:
+            headers['Content-Encoding'] = self.encoding
+        return headers
+
+    @property
+    def json(self) -> builtins.bytes:
+        return gzip.decompress(self.data) if self.encoding == 'gzip' else self.data
+
+    @property
+    def item(self) -> Dict[builtins.str, Any]:
+        """ The product back as a dict, e.g. to log or dead-letter it. """
+
+        item: Dict[builtins.str, Any] = json.loads(self.json)
+        return item
+
+
+Product = Union[Dict[builtins.str, Any], ProductPayload]
+""" What senders take: a product dict or its payload. """
+
+
+def encode_json(item: Dict[builtins.str, Any]) -> builtins.bytes:
+    """ Compact UTF-8 JSON of `item`; raises ValueError on NaN or
+    infinite numbers, which are not JSON. """
+
+    return json.dumps(item, separators=(',', ':'), ensure_ascii=False, allow_nan=False).encode('utf-8')
+
+
+def encode_products(
+        items: Iterable[Dict[builtins.str, Any]],
+        *,
+        compress: builtins.bool = False,
+        min_size: builtins.int = 1024
+) -> List[ProductPayload]:
+    """ Payloads of `items`. With `compress`, the ones of at least
+    `min_size` bytes are gzipped when that makes them smaller, which
+    pays off on long descriptions only. """
+
+    payloads = []
+    for item in items:
+        data = encode_json(item)
+        encoding = None
+        if compress and len(data) >= min_size:
+            compressed = gzip.compress(data, compresslevel=6, mtime=0)
+            if len(compressed) < len(data):
+                data, encoding = compressed, 'gzip'
+        payloads.append(ProductPayload(builtins.str(item.get('sku')), data, encoding))
+
+    return payloads
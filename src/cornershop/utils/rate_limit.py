@@ -0,0 +1,121 @@
+import asyncio
+import builtins
+import multiprocessing
+import time
+from typing import Any, Mapping, Optional
+
+from .retry import RetryPolicy
+
+_RATE, _MAX_RATE, _BURST, _TOKENS, _UPDATED, _PAUSED_UNTIL, _DECREASED_AT, _WINDOW_ENDS = range(8)
+""" `RateLimiter` shared state fields. """
+
+
+class RateLimiter:
+    """ Token bucket of product requests: `rate` of them by second, up
+    to `burst` at once. Its state lives in shared memory, so the asyncio
+    sender, worker threads and spawned worker processes given the same
+    limiter (processes through their initializer) share one pace.
+
+    The pace follows the server: a 429 (or a 503 with `Retry-After`)
+    halves the rate, once for all the requests sent before it was
+    halved, and pauses everyone for `Retry-After` seconds.
+    `RateLimit-Remaining` / `RateLimit-Reset` headers (or their `X-`
+    variants) set it a bit under what is left of the server's window
+    until the window resets (or pause everyone till then when nothing is
+    left), and other responses bring it back towards `rate`. """
+
+    HEADROOM = 0.9
+    """ Share of the server's allowed rate that is used. """
+
+    def __init__(
+            self,
+            rate: builtins.float,
+            *,
+            burst: Optional[builtins.float] = None,
+            min_rate: builtins.float = 0.1,
+            recovery: builtins.float = 0.02
+    ) -> None:
+
+        burst = burst or max(1.0, rate)
+        self.min_rate = min(min_rate, rate)
+        self.recovery = recovery
+        self._state = multiprocessing.get_context('spawn').Array(
+            'd', [rate, rate, burst, burst, time.monotonic(), 0.0, 0.0, 0.0]
+        )
+
+    @property
+    def rate(self) -> builtins.float:
+        return self._state[_RATE]
+
+    def reserve(self) -> builtins.float:
+        """ Takes a token, returning the seconds to wait before using it. """
+
+        with self._state.get_lock():
+            state = self._state
+            now = time.monotonic()
+            if state[_WINDOW_ENDS] and now >= state[_WINDOW_ENDS]:
+                # the server's window reset, so did what it allows.
+                state[_RATE] = state[_MAX_RATE]
+                state[_WINDOW_ENDS] = 0.0
+            state[_TOKENS] = min(state[_BURST], state[_TOKENS] + (now - state[_UPDATED]) * state[_RATE])
+            state[_UPDATED] = now
+            state[_TOKENS] -= 1
+            wait = -state[_TOKENS] / state[_RATE] if state[_TOKENS] < 0 else 0.0
+            return max(wait, state[_PAUSED_UNTIL] - now)
+
+    def acquire(self) -> None:
+        time.sleep(self.reserve())
+
+    async def acquire_async(self) -> None:
+        await asyncio.sleep(self.reserve())
+
+    def update(
+            self,
+            status: Optional[builtins.int],
+            headers: Mapping[builtins.str, Any],
+            *,
+            issued_at: Optional[builtins.float] = None
+    ) -> None:
+        """ Adjusts the pace to a response (`status` None when the
+        request failed) to a request sent at `issued_at`, a
+        `time.monotonic()` (now, if not given). """
+
+        retry_after = RetryPolicy.parse_retry_after(headers.get('Retry-After'))
+        remaining = self._header(headers, 'RateLimit-Remaining')
+        reset = self._header(headers, 'RateLimit-Reset')
+        if reset is not None and reset > 1e9:
+            # some servers send the reset as an epoch timestamp.
+            reset = max(0.0, reset - time.time())
+
+        with self._state.get_lock():
+            state = self._state
+            now = time.monotonic()
+            if status == 429 or (status == 503 and retry_after is not None):
+                # requests in flight when the rate was halved were sent
+                # too fast already: their throttling is the same one.
+                if (now if issued_at is None else issued_at) >= state[_DECREASED_AT]:
+                    state[_RATE] = max(self.min_rate, state[_RATE] / 2)
+                    state[_DECREASED_AT] = now
+                if retry_after:
+                    state[_PAUSED_UNTIL] = max(state[_PAUSED_UNTIL], now + retry_after)
+                    state[_TOKENS] = min(state[_TOKENS], 0.0)
+            elif remaining is not None and reset:
+                if remaining < 1:
+                    # the rate is left alone, or requests reserved meanwhile
+                    # would wait at a crawl past the reset.
+                    state[_PAUSED_UNTIL] = max(state[_PAUSED_UNTIL], now + reset)
+                    state[_TOKENS] = min(state[_TOKENS], 0.0)
+                else:
+                    state[_RATE] = min(state[_MAX_RATE], max(self.min_rate, self.HEADROOM * remaining / reset))
+                    state[_WINDOW_ENDS] = now + reset
+            elif status is not None and status < 500:
+                state[_RATE] = min(state[_MAX_RATE], state[_RATE] + self.recovery * state[_MAX_RATE])
+
+    @staticmethod
+    def _header(headers: Mapping[builtins.str, Any], name: builtins.str) -> Optional[builtins.float]:
+
+        value = headers.get(name) or headers.get(f'X-{name}')
+        try:
+            return builtins.float(value) if value is not None else None
+        except ValueError:
+            return None
@@ -0,0 +1,58 @@
+import builtins
+import email.utils
+import random
+import time
+from typing import Optional
+
+
+class RetryPolicy:
+    """ When and after how long a product request is retried: on
+    failed requests, 429 and 5xx, up to `retries` times, waiting
+    `base * 2 ** attempt` seconds (capped by `max_delay`) with full
+    jitter, or what the server asked in `Retry-After`. """
+
+    def __init__(
+            self,
+            retries: builtins.int = 3,
+            *,
+            base: builtins.float = 0.5,
+            max_delay: builtins.float = 30.0
+    ) -> None:
+
+        self.retries = retries
+        self.base = base
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_retryable(status: Optional[builtins.int]) -> builtins.bool:
+        return status is None or status == 429 or status >= 500
+
+    def delay(
+            self,
+            attempt: builtins.int,
+            retry_after: Optional[builtins.str] = None
+    ) -> builtins.float:
+
+        asked = self.parse_retry_after(retry_after)
+        if asked is not None:
+            return min(asked, self.max_delay)
+
+        return random.uniform(0, min(self.max_delay, self.base * 2 ** attempt))
+
+    @staticmethod
+    def parse_retry_after(value: Optional[builtins.str]) -> Optional[builtins.float]:
+        """ Seconds of a `Retry-After` header, which holds either
+        seconds or an HTTP date. """
+
+        if not value:
+            return None
+        try:
+            return max(0.0, builtins.float(value))
+        except ValueError:
+            pass
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+        return max(0.0, date.timestamp() - time.time())
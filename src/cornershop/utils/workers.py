@@ -0,0 +1,199 @@
+""" Pool of workers sending products. Each worker builds its own
+API (so its own session and token) once, when it starts, and closes
+it when the pool does; tasks carry only the product to send. """
+
+import builtins
+import functools
+import logging
+import multiprocessing
+import multiprocessing.util
+import threading
+from concurrent.futures import Executor, FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from types import TracebackType
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from .api import API, APIOps
+from .concurrency import AIMDController
+from .dead_letter import DeadLetter
+from .payload import Product
+from .rate_limit import RateLimiter
+from .retry import RetryPolicy
+
+_WORKER = threading.local()
+""" The worker's API: one by thread, so one by process as well. """
+
+
+def build_api(
+        credentials_file: builtins.str,
+        url: builtins.str,
+        *,
+        timeout: Tuple[builtins.float, builtins.float],
+        logger_name: builtins.str,
+        retries: builtins.int = 3,
+        dead_letter: Optional[builtins.str] = None,
+        rate_limiter: Optional[RateLimiter] = None
+) -> API:
+    """ API of a worker; its token comes from the token cache. """
+
+    logger = logging.getLogger(logger_name)
+    if not logger.handlers:
+        # a spawned process starts without the parent's logging setup.
+        from ..set_up import IntegrationSetup
+        IntegrationSetup()
+
+    return API(
+        api=APIOps(
+            credentials_file,
+            url,
+            pool_size=1,
+            timeout=timeout,
+            retry=RetryPolicy(retries),
+            rate_limiter=rate_limiter
+        ),
+        logger=logger,
+        dead_letter=DeadLetter(dead_letter) if dead_letter else None
+    )
+
+
+def api_factory(
+        credentials_file: builtins.str,
+        url: builtins.str,
+        *,
+        timeout: Tuple[builtins.float, builtins.float],
+        logger_name: builtins.str,
+        retries: builtins.int = 3,
+        dead_letter: Optional[builtins.str] = None,
+        rate_limiter: Optional[RateLimiter] = None
+) -> Callable[[], API]:
+    """ Picklable `build_api` call, for `ProductSender`; with a
+    `rate_limiter`, only while starting its workers. """
+
+    return functools.partial(
+        build_api,
+        credentials_file,
+        url,
+        timeout=timeout,
+        logger_name=logger_name,
+        retries=retries,
+        dead_letter=dead_letter,
+        rate_limiter=rate_limiter
+    )
+
+
+def _init_thread_worker(api_factory: Callable[[], API], apis: List[API]) -> None:
+
+    _WORKER.api = api_factory()
+    # closed by `ProductSender.close`, once its threads are done.
+    apis.append(_WORKER.api)
+
+
+def _init_process_worker(api_factory: Callable[[], API]) -> None:
+
+    _WORKER.api = api_factory()
+    # worker processes leave through `os._exit`, skipping atexit hooks,
+    # but multiprocessing finalizers do run.
+    multiprocessing.util.Finalize(None, _WORKER.api.close, exitpriority=10)
+
+
+def _send_product(
+        product: Tuple[builtins.int, Product]
+) -> Tuple[Optional[builtins.int], List[Tuple[Optional[builtins.int], builtins.float]]]:
+    """ Response status of sending `product`, and the status and
+    latency of every attempt at it, retries included. """
+
+    attempts: List[Tuple[Optional[builtins.int], builtins.float]] = []
+
+    def on_attempt(status: Optional[builtins.int], latency: builtins.float) -> None:
+        attempts.append((status, latency))
+
+    return _WORKER.api.send_products(product, on_attempt=on_attempt), attempts
+
+
+class ProductSender:
+
+    KINDS = ('threads', 'processes')
+
+    def __init__(
+            self,
+            kind: builtins.str,
+            workers: builtins.int,
+            api_factory: Callable[[], API]
+    ) -> None:
+
+        if kind not in self.KINDS:
+            raise ValueError(f'`kind` must be one of {self.KINDS}.')
+
+        self._executor: Executor
+        self._apis: List[API] = []
+        if kind == 'threads':
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers,
+                initializer=_init_thread_worker,
+                initargs=(api_factory, self._apis)
+            )
+        else:
+            # spawned, not forked: workers do not inherit the parent's dataframes.
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_process_worker,
+                initargs=(api_factory,)
+            )
+        self._workers = workers
+
+    def send(
+            self,
+            items: Iterable[Product],
+            controller: Optional[AIMDController] = None
+    ) -> Dict[builtins.str, builtins.int]:
+        """ Sends `items`, with as many in flight as workers, or as
+        `controller` says. Returns how many have been ingested and how
+        many failed, plus the concurrency it ended with. """
+
+        summary = {'ingested': 0, 'failed': 0}
+        pending: Set[Future] = set()
+        for product in enumerate(items, start=1):
+            while len(pending) >= min(self._workers, controller.concurrency if controller else self._workers):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                self._collect(done, summary, controller)
+            pending.add(self._executor.submit(_send_product, product))
+        done, _ = wait(pending)
+        self._collect(done, summary, controller)
+
+        if controller:
+            summary['concurrency'] = controller.concurrency
+        return summary
+
+    @staticmethod
+    def _collect(
+            done: Set[Future],
+            summary: Dict[builtins.str, builtins.int],
+            controller: Optional[AIMDController]
+    ) -> None:
+
+        for future in done:
+            status, attempts = future.result()
+            if controller:
+                for attempt in attempts:
+                    controller.record(*attempt)
+            summary['ingested' if status == 200 else 'failed'] += 1
+
+    def close(self) -> None:
+
+        self._executor.shutdown(wait=True)
+        for api in self._apis:
+            api.close()
+        self._apis.clear()
+
+    def __enter__(self) -> 'ProductSender':
+        return self
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc: Optional[BaseException],
+            tb: Optional[TracebackType]
+    ) -> None:
+
+        self.close()
+
@@ -0,0 +1,135 @@
+""" Local HTTP stand-in of the API and assets servers. """
+
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self):
+        # APIOps joins paths as base_url + path, e.g. '//oauth/token'.
+        path = '/' + self.path.lstrip('/')
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        with self.server.lock:
+            self.server.requests.append((self.command, path, dict(self.headers), body))
+        route = self.server.route_for(self.command, path)
+        if route is None:
+            status, headers, payload = 404, {}, b''
+        else:
+            try:
+                status, headers, payload = route(self, path, body)
+            except ConnectionAbortedError:
+                return
+        if isinstance(payload, (dict, list)):
+            payload = json.dumps(payload).encode()
+            headers = {'content-type': 'application/json', **headers}
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('content-length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _dispatch
+
+
+class MockServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = 0
+        self.merchants = [
+            {'id': 'm-1', 'name': "Richard's", 'is_active': False},
+            {'id': 'm-2', 'name': 'Beauty', 'is_active': True},
+        ]
+        self.routes = {
+            ('POST', '/oauth/token'): lambda h, p, b: (200, {}, {'access_token': 'token', 'expires_in': 7200}),
+            ('GET', '/api/merchants'): lambda h, p, b: (200, {}, {'merchants': self.merchants}),
+            ('PUT', '/api/merchants/'): lambda h, p, b: (200, {}, json.loads(b)),
+            ('DELETE', '/api/merchants/'): lambda h, p, b: (200, {}, b''),
+            ('POST', '/api/products'): lambda h, p, b: (200, {}, {}),
+        }
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/'
+
+    def route_for(self, method, path):
+        # the longest route prefix wins.
+        matches = [k for k in self.routes if k[0] == method and path.split('?')[0].startswith(k[1])]
+        return self.routes[max(matches, key=lambda k: len(k[1]))] if matches else None
+
+    def add_file(self, path, content, *, headers=None, ranges=True, drop_after=None):
+        """ Serves `content` at `path`, honouring single `Range`s (and
+        `If-Range`) when `ranges`. With `drop_after`, a response is cut
+        after that many bytes, as a dropped connection would. """
+
+        def serve(handler, request_path, body):
+            file_headers = {'ETag': '"v1"', **(headers or {})}
+            if ranges:
+                file_headers['Accept-Ranges'] = 'bytes'
+            if handler.headers.get('If-None-Match') == file_headers['ETag']:
+                return 304, file_headers, b''
+            payload, status = content, 200
+            range_ = handler.headers.get('Range')
+            if_range = handler.headers.get('If-Range')
+            if ranges and range_ and (if_range is None or if_range == file_headers['ETag']):
+                start, end = range_.split('=')[1].split('-')
+                end = int(end) if end else len(content) - 1
+                payload, status = content[int(start):end + 1], 206
+                file_headers['Content-Range'] = f'bytes {start}-{end}/{len(content)}'
+            if drop_after is not None and handler.command != 'HEAD' and len(payload) > drop_after:
+                handler.send_response(status)
+                for k, v in file_headers.items():
+                    handler.send_header(k, v)
+                handler.send_header('content-length', str(len(payload)))
+                handler.end_headers()
+                handler.wfile.write(payload[:drop_after])
+                handler.close_connection = True
+                raise ConnectionAbortedError
+            return status, file_headers, payload
+
+        self.routes[('GET', path)] = serve
+        self.routes[('HEAD', path)] = serve
+
+    def requests_to(self, method, path):
+        return [r for r in self.requests if r[0] == method and r[1].split('?')[0].startswith(path)]
+
+
+@pytest.fixture
+def mock_server():
+    server = MockServer()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def credentials_file(tmp_path):
+    path = tmp_path.joinpath('.config.json')
+    path.write_text(json.dumps({
+        k: base64.b64encode(v.encode()).decode()
+        for k, v in {'client_id': 'id', 'client_secret': 'secret', 'grant_type': 'client_credentials'}.items()
+    }))
+    return str(path)
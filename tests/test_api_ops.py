@@ -0,0 +1,275 @@
+import gzip
+import json
+import os
+import logging
+import pickle
+import threading
+
+import pytest
+
+from src.cornershop.utils import AIMDController, DeadLetter, ProductSender, RetryPolicy, api_factory, encode_products
+from src.cornershop.utils.api import API, APIOps
+
+
+def test_requests_reuse_pooled_connection(mock_server, credentials_file):
+    api = APIOps(credentials_file, mock_server.url)
+    for n in range(5):
+        assert api.send_product_data({'sku': str(n)}) == 200
+    api.merchant_info('Beauty')
+    api.close()
+    assert mock_server.connections == 1
+    assert len(mock_server.requests_to('POST', '/api/products')) == 5
+
+def test_session_is_not_pickled(mock_server, credentials_file):
+    api = APIOps(credentials_file, mock_server.url)
+    clone = pickle.loads(pickle.dumps(api))
+    assert clone._session is None and clone.headers == api.headers
+    assert clone.send_product_data({'sku': '1'}) == 200
+
+def test_token_is_cached_across_instances(mock_server, credentials_file):
+    APIOps(credentials_file, mock_server.url)
+    api = APIOps(credentials_file, mock_server.url)
+    assert len(mock_server.requests_to('POST', '/oauth/token')) == 1
+    assert os.stat(api.token_cache).st_mode & 0o777 == 0o600
+
+def test_expiring_token_is_refreshed(mock_server, credentials_file):
+    mock_server.routes[('POST', '/oauth/token')] = lambda h, p, b: (200, {}, {'access_token': 't', 'expires_in': 30})
+    api = APIOps(credentials_file, mock_server.url)
+    api.send_product_data({'sku': '1'})
+    assert len(mock_server.requests_to('POST', '/oauth/token')) == 2
+
+def test_unauthorized_product_is_retried_once_with_new_token(mock_server, credentials_file):
+    tokens = iter(['old', 'new'])
+    mock_server.routes[('POST', '/oauth/token')] = lambda h, p, b: (200, {}, {'access_token': next(tokens), 'expires_in': 7200})
+    mock_server.routes[('POST', '/api/products')] = lambda h, p, b: (200 if h.headers['token'] == 'Bearer new' else 401, {}, {})
+    api = APIOps(credentials_file, mock_server.url)
+    assert api.send_product_data({'sku': '1'}) == 200
+    assert len(mock_server.requests_to('POST', '/api/products')) == 2
+
+def test_async_token_refresh_runs_off_the_event_loop(mock_server, credentials_file):
+    tokens = iter([('old', 30), ('new', 7200)])
+    mock_server.routes[('POST', '/oauth/token')] = lambda h, p, b: (
+        200, {}, dict(zip(('access_token', 'expires_in'), next(tokens)))
+    )
+    ops = APIOps(credentials_file, mock_server.url)
+    token, threads = ops._token, []
+    ops._token = lambda force=False: threads.append(threading.current_thread()) or token(force)
+    api = API(api=ops, logger=logging.getLogger('test'))
+    assert api.send_products_async(({'sku': str(n)} for n in range(20)), concurrency=8) == {'ingested': 20, 'failed': 0}
+    # concurrent requests shared the one refresh, made outside the loop's thread.
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    assert {r[2]['token'] for r in mock_server.requests_to('POST', '/api/products')} == {'Bearer new'}
+
+def test_merchant_ops_download_merchants_once(mock_server, credentials_file):
+    api = APIOps(credentials_file, mock_server.url)
+    assert api.merchant_info('Richard')['id'] == 'm-1'
+    api.update_merchant_info("Richard's", 'is_active', True)
+    api.delete_merchant_info('Beauty')
+    assert len(mock_server.requests_to('GET', '/api/merchants')) == 1
+    assert api.merchant_info("Richard's")['is_active'] is True
+    assert api.merchants.find('Beauty') is None
+
+def test_merchants_are_revalidated_with_etag(mock_server, credentials_file):
+    def merchants(handler, path, body):
+        if handler.headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"'}, b''
+        return 200, {'ETag': '"v1"'}, {'merchants': mock_server.merchants}
+    mock_server.routes[('GET', '/api/merchants')] = merchants
+    api = APIOps(credentials_file, mock_server.url, merchants_ttl=0)
+    api.merchant_info('Beauty')
+    assert api.merchant_info('Beauty')['id'] == 'm-2'
+    gets = mock_server.requests_to('GET', '/api/merchants')
+    assert len(gets) == 2 and gets[1][2].get('If-None-Match') == '"v1"'
+
+def test_merchants_pages_are_followed(mock_server, credentials_file):
+    def merchants(handler, path, body):
+        if 'page=2' in path:
+            return 200, {}, {'merchants': mock_server.merchants[1:]}
+        return 200, {'Link': f'<{mock_server.url}api/merchants?page=2>; rel="next"'}, {'merchants': mock_server.merchants[:1]}
+    mock_server.routes[('GET', '/api/merchants')] = merchants
+    api = APIOps(credentials_file, mock_server.url)
+    assert api.merchant_info('Beauty')['id'] == 'm-2'
+
+def test_async_sender_sends_every_product(mock_server, credentials_file):
+    mock_server.routes[('POST', '/api/products')] = lambda h, p, b: (500 if b'"sku": "13"' in b else 200, {}, {})
+    api = API(api=APIOps(credentials_file, mock_server.url, retry=RetryPolicy(0)), logger=logging.getLogger('test'))
+    summary = api.send_products_async(({'sku': str(n)} for n in range(50)), concurrency=8)
+    assert summary == {'ingested': 49, 'failed': 1}
+    assert len(mock_server.requests_to('POST', '/api/products')) == 50
+    assert mock_server.connections <= 9
+
+def test_product_sender_workers(mock_server, credentials_file):
+    APIOps(credentials_file, mock_server.url)
+    factory = api_factory(credentials_file, mock_server.url, timeout=(5.0, 30.0), logger_name='test')
+    for kind in ProductSender.KINDS:
+        with ProductSender(kind, 2, factory) as sender:
+            assert sender.send({'sku': str(n)} for n in range(10)) == {'ingested': 10, 'failed': 0}
+    # every worker got its token from the cache.
+    assert len(mock_server.requests_to('POST', '/oauth/token')) == 1
+
+def test_product_sender_closes_worker_sessions(mock_server, credentials_file):
+    APIOps(credentials_file, mock_server.url)
+    factory = api_factory(credentials_file, mock_server.url, timeout=(5.0, 30.0), logger_name='test')
+    built = []
+    with ProductSender('threads', 2, lambda: built.append(factory()) or built[-1]) as sender:
+        sender.send({'sku': str(n)} for n in range(10))
+        assert all(api._api._session is not None for api in built)
+    assert built and all(api._api._session is None for api in built)
+
+def test_adaptive_sender_reports_settled_concurrency(mock_server, credentials_file):
+    sent = []
+
+    def products(handler, path, body):
+        with mock_server.lock:
+            sent.append(body)
+            return 429 if len(sent) <= 3 else 200, {}, {}
+    mock_server.routes[('POST', '/api/products')] = products
+    api = API(api=APIOps(credentials_file, mock_server.url, retry=RetryPolicy(0)), logger=logging.getLogger('test'))
+    controller = AIMDController(4, maximum=8)
+    summary = api.send_products_async(({'sku': str(n)} for n in range(60)), concurrency=4, controller=controller)
+    assert summary['ingested'] == 57 and summary['failed'] == 3
+    assert summary['concurrency'] == controller.concurrency and 1 <= summary['concurrency'] <= 8
+
+def test_controller_hears_of_retried_attempts(mock_server, credentials_file):
+    seen = set()
+
+    def products(handler, path, body):
+        # every product is throttled once, then accepted on its retry.
+        with mock_server.lock:
+            sku = json.loads(body)['sku']
+            first = sku not in seen
+            seen.add(sku)
+        return (429, {'Retry-After': '0'}, {}) if first else (200, {}, {})
+    mock_server.routes[('POST', '/api/products')] = products
+
+    class Recorder(AIMDController):
+        def record(self, status, latency):
+            heard.append(status)
+            super().record(status, latency)
+
+    heard = []
+    api = API(api=APIOps(credentials_file, mock_server.url, retry=RetryPolicy(1, base=0)), logger=logging.getLogger('test'))
+    summary = api.send_products_async(({'sku': str(n)} for n in range(6)), concurrency=2, controller=Recorder(2, maximum=4))
+    assert summary['ingested'] == 6 and sorted(heard) == [200] * 6 + [429] * 6
+
+    heard.clear()
+    seen.clear()
+    factory = api_factory(credentials_file, mock_server.url, timeout=(5.0, 30.0), logger_name='test', retries=1)
+    with ProductSender('threads', 2, factory) as sender:
+        assert sender.send(({'sku': str(n)} for n in range(6)), Recorder(2, maximum=4))['ingested'] == 6
+    assert sorted(heard) == [200] * 6 + [429] * 6
+
+def test_throttled_product_is_retried_after_asked_delay(mock_server, credentials_file):
+    statuses = iter([429, 503, 200, 429, 503, 200])
+    mock_server.routes[('POST', '/api/products')] = lambda h, p, b: (next(statuses), {'Retry-After': '0'}, {})
+    api = APIOps(credentials_file, mock_server.url, retry=RetryPolicy(2, base=10.0))
+    assert api.send_product_data({'sku': '1'}) == 200
+    async_api = API(api=api, logger=logging.getLogger('test'))
+    assert async_api.send_products_async([{'sku': '2'}], concurrency=1) == {'ingested': 1, 'failed': 0}
+    assert len(mock_server.requests_to('POST', '/api/products')) == 6
+
+def test_retry_after_http_date_and_backoff_cap():
+    policy = RetryPolicy(3, base=1.0, max_delay=2.0)
+    assert 0 <= policy.delay(5) <= 2.0
+    assert policy.delay(0, 'Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert not RetryPolicy.is_retryable(400) and RetryPolicy.is_retryable(None)
+
+def test_failed_products_are_dead_lettered_and_replayed(mock_server, credentials_file, tmp_path):
+    mock_server.routes[('POST', '/api/products')] = lambda h, p, b: (500 if b'"sku": "3"' in b else 200, {}, {})
+    dead_letter = DeadLetter(str(tmp_path.joinpath('failed.ndjson')))
+    api = API(
+        api=APIOps(credentials_file, mock_server.url, retry=RetryPolicy(1, base=0.01)),
+        logger=logging.getLogger('test'),
+        dead_letter=dead_letter
+    )
+    assert api.send_products_async(({'sku': str(n)} for n in range(5)), concurrency=2)['failed'] == 1
+    taken = dead_letter.take()
+    assert list(DeadLetter.items(taken)) == [{'sku': '3'}] and not os.path.exists(dead_letter.path)
+    mock_server.routes[('POST', '/api/products')] = lambda h, p, b: (200, {}, {})
+    assert api.send_products_async(DeadLetter.items(taken), concurrency=2) == {'ingested': 1, 'failed': 0}
+    assert dead_letter.take() is None
+
+def _bulk_products(mock_server, *, accepts_arrays=True, bad_sku=None, max_bytes=None):
+    def products(handler, path, body):
+        if max_bytes and len(body) > max_bytes:
+            return 413, {}, {}
+        if handler.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        payload = json.loads(body)
+        if isinstance(payload, list) and not accepts_arrays:
+            return 400, {}, {}
+        batch = payload if isinstance(payload, list) else [payload]
+        return 422 if any(p['sku'] == bad_sku for p in batch) else 200, {}, {}
+    mock_server.routes[('POST', '/api/products')] = products
+
+def test_bulk_sender_batches_products(mock_server, credentials_file):
+    _bulk_products(mock_server)
+    api = API(api=APIOps(credentials_file, mock_server.url), logger=logging.getLogger('test'))
+    summary = api.send_products_bulk(({'sku': str(n)} for n in range(1000)), max_items=100)
+    assert summary == {'ingested': 1000, 'failed': 0, 'requests': 10}
+    sent = [json.loads(r[3]) for r in mock_server.requests_to('POST', '/api/products')]
+    assert sorted(int(p['sku']) for batch in sent for p in batch) == list(range(1000))
+
+def test_bulk_sender_isolates_bad_product(mock_server, credentials_file):
+    _bulk_products(mock_server, bad_sku='13')
+    api = API(api=APIOps(credentials_file, mock_server.url), logger=logging.getLogger('test'))
+    summary = api.send_products_bulk(({'sku': str(n)} for n in range(64)), max_items=32)
+    assert summary['ingested'] == 63 and summary['failed'] == 1
+    assert summary['requests'] < 20
+
+def test_bulk_sender_falls_back_to_single_products(mock_server, credentials_file):
+    _bulk_products(mock_server, accepts_arrays=False)
+    api = API(api=APIOps(credentials_file, mock_server.url), logger=logging.getLogger('test'))
+    summary = api.send_products_bulk(({'sku': str(n)} for n in range(40)), max_items=4)
+    assert summary['ingested'] == 40 and summary['failed'] == 0
+    arrays = [r for r in mock_server.requests_to('POST', '/api/products') if r[3].startswith(b'[')]
+    assert len(arrays) == 2
+
+def test_bulk_sender_shrinks_too_large_batches(mock_server, credentials_file):
+    _bulk_products(mock_server, max_bytes=300)
+    api = API(api=APIOps(credentials_file, mock_server.url), logger=logging.getLogger('test'))
+    summary = api.send_products_bulk(({'sku': str(n)} for n in range(100)), max_items=100)
+    assert summary['ingested'] == 100 and summary['failed'] == 0
+    sizes = [len(r[3]) for r in mock_server.requests_to('POST', '/api/products')]
+    assert sizes[0] > 300 and all(size <= 300 for size in sizes[-5:])
+
+def _decoded_products(mock_server):
+    def products(handler, path, body):
+        if handler.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        product = json.loads(body)
+        return 500 if product['sku'] == 'bad' else 200, {}, {}
+    mock_server.routes[('POST', '/api/products')] = products
+
+def test_payloads_are_sent_as_encoded(mock_server, credentials_file, tmp_path):
+    _decoded_products(mock_server)
+    items = [{'sku': str(n), 'description': 'á' * 2000 if n % 2 else 'short'} for n in range(4)]
+    items.append({'sku': 'bad', 'description': 'x' * 2000})
+    payloads = encode_products(items, compress=True)
+    assert [p.encoding for p in payloads] == [None, 'gzip', None, 'gzip', 'gzip']
+    assert payloads[1].item == items[1] and len(payloads[1].data) < 200
+    dead_letter = DeadLetter(str(tmp_path.joinpath('failed.ndjson')))
+    api = API(
+        api=APIOps(credentials_file, mock_server.url, retry=RetryPolicy(0)),
+        logger=logging.getLogger('test'),
+        dead_letter=dead_letter
+    )
+    assert api.send_products_async(payloads, concurrency=2) == {'ingested': 4, 'failed': 1}
+    assert api.send_products((1, payloads[3])) == 200
+    assert list(DeadLetter.items(dead_letter.path)) == [items[-1]]
+    sent = mock_server.requests_to('POST', '/api/products')
+    assert sent[1][2]['Content-Encoding'] == 'gzip' and sent[1][2]['Content-Type'] == 'application/json'
+
+def test_payloads_reject_nan():
+    with pytest.raises(ValueError):
+        encode_products([{'sku': '1', 'brand': float('nan')}])
+
+def test_payloads_in_worker_processes_and_bulk(mock_server, credentials_file):
+    APIOps(credentials_file, mock_server.url)
+    payloads = encode_products(({'sku': str(n)} for n in range(10)), compress=True)
+    factory = api_factory(credentials_file, mock_server.url, timeout=(5.0, 30.0), logger_name='test')
+    with ProductSender('processes', 2, factory) as sender:
+        assert sender.send(payloads) == {'ingested': 10, 'failed': 0}
+    _bulk_products(mock_server)
+    api = API(api=APIOps(credentials_file, mock_server.url), logger=logging.getLogger('test'))
+    assert api.send_products_bulk(payloads, max_items=5, compress=True)['requests'] == 2
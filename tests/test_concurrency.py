@@ -0,0 +1,27 @@
+from src.cornershop.utils import AIMDController
+
+
+def _window(controller, status=200, latency=0.01):
+    for _ in range(controller.concurrency):
+        controller.record(status, latency)
+
+
+def test_concurrency_grows_while_healthy():
+    controller = AIMDController(4, maximum=6)
+    for _ in range(5):
+        _window(controller)
+    assert controller.concurrency == 6
+
+def test_concurrency_backs_off_on_throttling_and_errors():
+    controller = AIMDController(8, maximum=16)
+    _window(controller, status=429)
+    assert controller.concurrency == 4
+    _window(controller, status=None)
+    _window(controller, status=503)
+    assert controller.concurrency == 1
+
+def test_concurrency_backs_off_on_rising_latency():
+    controller = AIMDController(8, maximum=16)
+    _window(controller, latency=0.01)
+    _window(controller, latency=0.5)
+    assert controller.concurrency == 4
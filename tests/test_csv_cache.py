@@ -0,0 +1,84 @@
+import os
+
+import pandas as pd
+
+from src.cornershop.utils.csv_cache import CSVCache, TextMemo
+
+CSV_CONTENT = 'SKU|BRANCH|PRICE\n1|MM|10.5\n2|RHSM|20.0\n'
+
+
+def _reader(calls):
+    def read(path):
+        calls.append(path)
+        return pd.read_csv(path, sep='|')
+    return read
+
+
+def test_cache_hit_does_not_reparse(tmp_path):
+    csv_path = tmp_path.joinpath('PRICES-STOCK.csv')
+    csv_path.write_text(CSV_CONTENT)
+    cache = CSVCache(str(tmp_path.joinpath('.cache')))
+    calls = []
+    first = cache.load(str(csv_path), _reader(calls))
+    second = cache.load(str(csv_path), _reader(calls))
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second)
+
+def test_touched_but_unchanged_file_keeps_cache(tmp_path):
+    csv_path = tmp_path.joinpath('PRICES-STOCK.csv')
+    csv_path.write_text(CSV_CONTENT)
+    cache = CSVCache(str(tmp_path.joinpath('.cache')))
+    calls = []
+    cache.load(str(csv_path), _reader(calls))
+    stat = os.stat(csv_path)
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.load(str(csv_path), _reader(calls))
+    assert len(calls) == 1
+
+def test_stale_cache_is_rebuilt(tmp_path):
+    csv_path = tmp_path.joinpath('PRICES-STOCK.csv')
+    csv_path.write_text(CSV_CONTENT)
+    cache = CSVCache(str(tmp_path.joinpath('.cache')))
+    calls = []
+    cache.load(str(csv_path), _reader(calls))
+    csv_path.write_text(CSV_CONTENT + '3|MM|30.0\n')
+    df = cache.load(str(csv_path), _reader(calls))
+    assert len(calls) == 2 and len(df) == 3
+
+def test_corrupt_cache_is_rebuilt(tmp_path):
+    csv_path = tmp_path.joinpath('PRICES-STOCK.csv')
+    csv_path.write_text(CSV_CONTENT)
+    cache_dir = tmp_path.joinpath('.cache')
+    cache = CSVCache(str(cache_dir))
+    calls = []
+    cache.load(str(csv_path), _reader(calls))
+    data_file = next(cache_dir.glob('*.pkl'))
+    data_file.write_bytes(data_file.read_bytes()[:10])
+    df = cache.load(str(csv_path), _reader(calls))
+    assert len(calls) == 2 and len(df) == 2
+
+def test_text_memo_is_bounded_and_persisted(tmp_path):
+    memo_path = str(tmp_path.joinpath('memo.pkl'))
+    memo = TextMemo(memo_path, max_entries=2)
+    memo['a'] = 1
+    memo['b'] = 2
+    memo.get('a')
+    memo['c'] = 3
+    memo.save()
+    reloaded = TextMemo(memo_path, max_entries=2)
+    assert len(reloaded) == 2 and reloaded.get('b') is None and reloaded.get('a') == 1
+
+def test_memo_is_bounded_by_bytes_and_saved_only_when_changed(tmp_path):
+    memo_path = str(tmp_path.joinpath('memo.pkl'))
+    memo = TextMemo(memo_path, max_bytes=400)
+    for n in range(5):
+        memo['<p>' + str(n) * 1000 + '</p>'] = (str(n) * 100, '1 KG')
+    assert len(memo) == 2 and memo.get('<p>' + '4' * 1000 + '</p>') == ('4' * 100, '1 KG')
+    memo.save()
+    assert os.path.getsize(memo_path) < 600
+
+    mtime = os.stat(memo_path).st_mtime_ns
+    reloaded = TextMemo(memo_path, max_bytes=400)
+    reloaded.get('<p>' + '3' * 1000 + '</p>')
+    reloaded.save()
+    assert os.stat(memo_path).st_mtime_ns == mtime
@@ -1,8 +1,12 @@
+import gzip
 from html.parser import HTMLParser
 
 import numpy as np
 import pandas as pd
 
+from src.cornershop.utils import CSVOps, CSVSchema, PandasOperations
+from src.cornershop.utils.csv_cache import TextMemo
+
 BRANCHES = ['MM', 'RHSM', 'MORPHEUS']
 BRANCHES_TOFILTER = ['MM', 'RHSM']
 STOCKS = [0, 1, 2, 3, 4]
@@ -69,4 +73,98 @@ def test_nan_to_none():
     MOCK_PACKAGES_NAN['PACKAGES'] = pd.Series(regex.values.tolist()).str.join(' ')
     print(MOCK_PACKAGES_NAN)
     MOCK_PACKAGES_NAN.loc[MOCK_PACKAGES_NAN['PACKAGES'].isna(), 'PACKAGES'] = None
-    assert not MOCK_PACKAGES_NAN['PACKAGES'].values.tolist()[0]
\ No newline at end of file
+    assert not MOCK_PACKAGES_NAN['PACKAGES'].values.tolist()[0]
+
+def test_streaming_filters_match_eager(tmp_path):
+    products_csv = tmp_path.joinpath('PRODUCTS.csv')
+    products_csv.write_text('SKU|ITEM_NAME\n1|a\n2|b\n3|c\n4|d\n5|e\n')
+    stock_csv = tmp_path.joinpath('PRICES-STOCK.csv')
+    stock_csv.write_text(
+        'SKU|BRANCH|PRICE|STOCK\n1|MM|10|1\n2|MORPHEUS|20|3\n'
+        '3|RHSM|30|0\n4|RHSM|40|2\n1|RHSM|15|5\n'
+    )
+    kwargs = dict(products_csv=str(products_csv), price_stock_csv=str(stock_csv), merchant_id='m')
+    eager = CSVOps(PandasOperations(), **kwargs)
+    eager.filter_by_branch('BRANCH', BRANCHES_TOFILTER)
+    eager.filter_by_stock_greater_than_zero('STOCK')
+    streamed = CSVOps(PandasOperations(), chunksize=2, **kwargs)
+    streamed.stream_filtered(branch_column='BRANCH', branches=BRANCHES_TOFILTER, stock_column='STOCK', sku_column='SKU')
+    pd.testing.assert_frame_equal(eager.stock, streamed.stock)
+    assert streamed.products['SKU'].tolist() == [1, 4]
+    pd.testing.assert_frame_equal(eager.dataframes_merge_on('SKU'), streamed.dataframes_merge_on('SKU'))
+
+def test_compressed_csvs_are_read_transparently(tmp_path):
+    products = b'SKU|ITEM_NAME\n1|a\n2|b\n3|c\n4|d\n5|e\n'
+    stock = b'SKU|BRANCH|PRICE|STOCK\n1|MM|10|1\n2|MORPHEUS|20|3\n3|RHSM|30|0\n4|RHSM|40|2\n'
+    tmp_path.joinpath('PRODUCTS.csv.gz').write_bytes(gzip.compress(products))
+    tmp_path.joinpath('PRICES-STOCK.csv').write_bytes(stock)
+    kwargs = dict(
+        products_csv=str(tmp_path.joinpath('PRODUCTS.csv')),
+        price_stock_csv=str(tmp_path.joinpath('PRICES-STOCK.csv')),
+        merchant_id='m'
+    )
+    eager = CSVOps(PandasOperations(), cache_dir=str(tmp_path.joinpath('cache')), **kwargs)
+    assert eager.products['ITEM_NAME'].tolist() == ['a', 'b', 'c', 'd', 'e']
+    streamed = CSVOps(PandasOperations(), chunksize=2, **kwargs)
+    streamed.stream_filtered(branch_column='BRANCH', branches=BRANCHES_TOFILTER, stock_column='STOCK', sku_column='SKU')
+    assert streamed.products['SKU'].tolist() == [1, 4]
+
+def test_schema_projects_and_compacts_columns(tmp_path):
+    schema = CSVSchema(categories=['BRANCH'], integers=['SKU', 'STOCK'], floats=['PRICE'])
+    stock_csv = tmp_path.joinpath('PRICES-STOCK.csv')
+    stock_csv.write_text(
+        'SKU|BRANCH|PRICE|STOCK|UNUSED\n1|MM|10.99|1|x\n2|RHSM|20.5|3|y\n3|MM|0.1|0|z\n'
+        '4|MM|131072.01|1|x\n5|MM|199999.99|1|x\n6|MM|1234567.89|1|x\n7|MM|16777217|1|x\n'
+    )
+    products_csv = tmp_path.joinpath('PRODUCTS.csv')
+    products_csv.write_text('SKU\n1\n2\n')
+    ops = CSVOps(PandasOperations(), products_csv=str(products_csv), price_stock_csv=str(stock_csv), merchant_id='m', schema=schema)
+    assert 'UNUSED' not in ops.stock.columns
+    assert isinstance(ops.stock['BRANCH'].dtype, pd.CategoricalDtype)
+    assert ops.stock['SKU'].dtype == np.int8 and ops.stock['PRICE'].dtype == np.float64
+    # prices of 2 ** 17 and more keep their cents.
+    assert schema.widen_floats(ops.stock)['PRICE'].tolist() == [
+        10.99, 20.5, 0.1, 131072.01, 199999.99, 1234567.89, 16777217.0
+    ]
+    report = ops.memory_report()['stock']
+    assert report['SKU']['saved'] == 7 * 7 and report['PRICE']['saved'] == 0
+
+def test_vectorized_concat_matches_row_wise():
+    cols = ['CATEGORY', 'SUB', 'SUBSUB']
+    mock = pd.DataFrame({'CATEGORY': ['Abarrotes', 'Lácteos', None], 'SUB': ['Sopas', np.nan, 'Quesos'], 'SUBSUB': ['X', 'Y', 'Z']})
+    mock['CATEGORY'] = mock['CATEGORY'].astype('category')
+    # '|'.join(row.values.astype(str)) of each row.
+    row_wise = ['Abarrotes|Sopas|X', 'Lácteos|nan|Y', 'nan|Quesos|Z']
+    assert PandasOperations.concat_columns_values(mock, '|', cols).tolist() == row_wise
+    assert PandasOperations.concat_columns_values(mock, '|', cols, lower=True).tolist() == [r.lower() for r in row_wise]
+
+def test_strip_html_and_extract_package():
+    mock = pd.DataFrame({'DESCRIPTION': ['<p>CHORIZO OAXACA CERDO 1 KG.</p>', 'RACK TV ALMA 1UN', np.nan, 'aoskaoskaosk 300 GRS']})
+    descriptions, packages = PandasOperations.strip_html_and_extract_package(mock, 'DESCRIPTION', PACKAGE_UNITS)
+    assert descriptions.tolist()[:2] == ['CHORIZO OAXACA CERDO 1 KG.', 'RACK TV ALMA 1UN']
+    assert pd.isna(descriptions.tolist()[2])
+    assert packages.tolist() == ['1 KG', '', '', '300 GRS']
+
+def test_strip_html_and_extract_package_uses_memo(tmp_path):
+    memo = TextMemo(str(tmp_path.joinpath('memo.pkl')))
+    memo['<b>memoized</b>'] = ('from memo', '1 KG')
+    mock = pd.DataFrame({'DESCRIPTION': ['<b>memoized</b>', 'LECHE 1 ML', 'LECHE 1 ML']})
+    descriptions, packages = PandasOperations.strip_html_and_extract_package(mock, 'DESCRIPTION', PACKAGE_UNITS, memo)
+    assert descriptions.tolist() == ['from memo', 'LECHE 1 ML', 'LECHE 1 ML']
+    assert packages.tolist() == ['1 KG', '1 ML', '1 ML'] and len(memo) == 2
+
+def test_top_n_by_group():
+    mock = pd.DataFrame({'BRANCH': ['MM', 'RHSM', 'MM', 'MORPHEUS', 'MM', 'RHSM'], 'PRICE': [5, 7, 9, 100, 1, 3]})
+    top = PandasOperations.top_n_by_group(mock, 'BRANCH', BRANCHES_TOFILTER, 'PRICE', 2)
+    expected = mock[mock['BRANCH'].isin(BRANCHES_TOFILTER)].sort_values('PRICE', ascending=False).groupby('BRANCH').head(2)
+    assert sorted(top.index.tolist()) == sorted(expected.index.tolist())
+    assert top[top['BRANCH'] == 'MM']['PRICE'].tolist() == [9, 5]
+
+def test_merge_branches():
+    mm = {'1': {'sku': '1', 'branch_products': [{'branch': 'MM'}]}, '2': {'sku': '2', 'branch_products': [{'branch': 'MM'}]}}
+    rhsm = {'2': {'sku': '2', 'branch_products': [{'branch': 'RHSM'}]}, '3': {'sku': '3', 'branch_products': [{'branch': 'RHSM'}]}}
+    morpheus = {'2': {'sku': '2', 'branch_products': [{'branch': 'MORPHEUS'}]}}
+    items = CSVOps.merge_branches(mm, rhsm, morpheus, column='branch_products')
+    assert [i['sku'] for i in items] == ['1', '2', '3']
+    assert [b['branch'] for b in items[1]['branch_products']] == ['MM', 'RHSM', 'MORPHEUS']
+    assert mm['2']['branch_products'] == [{'branch': 'MM'}]
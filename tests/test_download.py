@@ -0,0 +1,226 @@
+import base64
+import gzip
+import hashlib
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+from src.cornershop.set_up import IntegrationSetup
+from src.cornershop.utils import CSVOps, PandasOperations
+from src.cornershop.utils.download import AssetManifest, Downloader, StreamPipe
+
+CONTENT = bytes(range(256)) * 40
+
+
+def _ranges(mock_server, path):
+    return [r[2].get('Range') for r in mock_server.requests_to('GET', path)]
+
+def test_download_is_split_in_ranges(mock_server, tmp_path):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    assert Downloader(segments=4, min_segment_size=1000).download(f'{mock_server.url}PRODUCTS.csv', path)
+    assert open(path, 'rb').read() == CONTENT
+    assert sorted(_ranges(mock_server, '/PRODUCTS.csv')) == [
+        'bytes=0-2559', 'bytes=2560-5119', 'bytes=5120-7679', 'bytes=7680-10239'
+    ]
+    assert os.listdir(tmp_path) == ['PRODUCTS.csv']
+
+def test_download_without_ranges_is_one_stream(mock_server, tmp_path):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT, ranges=False)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    assert Downloader(segments=4, min_segment_size=1000).download(f'{mock_server.url}PRODUCTS.csv', path)
+    assert open(path, 'rb').read() == CONTENT
+    assert _ranges(mock_server, '/PRODUCTS.csv') == [None]
+
+def test_dropped_download_is_resumed(mock_server, tmp_path):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT, drop_after=3000)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    downloader = Downloader(segments=2, min_segment_size=1000, chunk_size=500, checkpoint_size=1, retries=0)
+    assert not downloader.download(f'{mock_server.url}PRODUCTS.csv', path)
+    assert not os.path.exists(path) and os.path.exists(f'{path}.part.json')
+
+    mock_server.add_file('/PRODUCTS.csv', CONTENT)
+    mock_server.requests.clear()
+    assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path)
+    assert open(path, 'rb').read() == CONTENT
+    starts = sorted(int(r.split('=')[1].split('-')[0]) for r in _ranges(mock_server, '/PRODUCTS.csv'))
+    assert starts[0] >= 2500 and starts[1] >= 5120 + 2500
+    assert not os.path.exists(f'{path}.part.json')
+
+def test_changed_remote_file_is_downloaded_again(mock_server, tmp_path):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT, drop_after=3000)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    downloader = Downloader(segments=2, min_segment_size=1000, chunk_size=500, checkpoint_size=1, retries=0)
+    downloader.download(f'{mock_server.url}PRODUCTS.csv', path)
+
+    changed = CONTENT[::-1]
+    mock_server.add_file('/PRODUCTS.csv', changed, headers={'ETag': '"v2"'})
+    assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path)
+    assert open(path, 'rb').read() == changed
+
+def test_unchanged_file_is_not_downloaded_again(mock_server, tmp_path):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    manifest = AssetManifest(str(tmp_path.joinpath('.manifest.json')))
+    downloader = Downloader(segments=2, min_segment_size=1000)
+    assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path, manifest)
+    entry = AssetManifest(manifest.path).get(path)
+    assert entry['etag'] == '"v1"' and entry['size'] == len(CONTENT)
+    assert entry['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+
+    mock_server.requests.clear()
+    assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path, manifest)
+    assert [r[0] for r in mock_server.requests] == ['HEAD']
+    assert mock_server.requests[0][2]['If-None-Match'] == '"v1"'
+
+def test_changed_or_corrupt_file_is_downloaded_again(mock_server, tmp_path):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    manifest = AssetManifest(str(tmp_path.joinpath('.manifest.json')))
+    downloader = Downloader(segments=2, min_segment_size=1000)
+    downloader.download(f'{mock_server.url}PRODUCTS.csv', path, manifest)
+
+    with open(path, 'r+b') as f:
+        f.write(b'corrupt')
+    assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path, manifest)
+    assert open(path, 'rb').read() == CONTENT
+
+    changed = CONTENT[::-1]
+    mock_server.add_file('/PRODUCTS.csv', changed, headers={'ETag': '"v2"'})
+    assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path, manifest)
+    assert open(path, 'rb').read() == changed
+    assert manifest.get(path)['sha256'] == hashlib.sha256(changed).hexdigest()
+
+def test_file_missing_from_manifest_is_downloaded_again(mock_server, tmp_path):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    # left truncated by an older run, which wrote straight to `path`.
+    with open(path, 'wb') as f:
+        f.write(CONTENT[:1000])
+    manifest = AssetManifest(str(tmp_path.joinpath('.manifest.json')))
+    assert Downloader(segments=2, min_segment_size=1000).download(f'{mock_server.url}PRODUCTS.csv', path, manifest)
+    assert open(path, 'rb').read() == CONTENT
+    assert manifest.get(path)['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+    assert not any('If-None-Match' in r[2] or 'If-Modified-Since' in r[2] for r in mock_server.requests)
+
+def test_download_can_be_stored_compressed(mock_server, tmp_path):
+    stock, _ = _rows(2000)
+    mock_server.add_file('/PRICES-STOCK.csv', stock)
+    path = str(tmp_path.joinpath('PRICES-STOCK.csv.gz'))
+    manifest = AssetManifest(str(tmp_path.joinpath('.manifest.json')))
+    downloader = Downloader(segments=3, min_segment_size=4096, compression='gzip')
+    received = []
+    assert downloader.download(f'{mock_server.url}PRICES-STOCK.csv', path, manifest, received.append)
+    assert gzip.decompress(open(path, 'rb').read()) == stock == b''.join(received)
+    assert os.path.getsize(path) < len(stock) / 2
+    entry = manifest.get(path)
+    assert entry['compression'] == 'gzip' and entry['content_sha256'] == hashlib.sha256(stock).hexdigest()
+    assert sorted(os.listdir(tmp_path)) == ['.manifest.json', 'PRICES-STOCK.csv.gz']
+
+    mock_server.requests.clear()
+    received.clear()
+    assert downloader.download(f'{mock_server.url}PRICES-STOCK.csv', path, manifest, received.append)
+    assert [r[0] for r in mock_server.requests] == ['HEAD'] and b''.join(received) == stock
+    # stored otherwise, it is not the file the manifest describes.
+    assert Downloader(segments=3, min_segment_size=4096)._conditional_headers(
+        f'{mock_server.url}PRICES-STOCK.csv', path, manifest.get(path)
+    ) == {}
+
+def test_download_is_checked_against_published_checksums(mock_server, tmp_path):
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    downloader = Downloader(segments=4, min_segment_size=1000, chunk_size=512)
+    sha256 = base64.b64encode(hashlib.sha256(CONTENT).digest()).decode()
+    mock_server.add_file('/PRODUCTS.csv', CONTENT, headers={'x-amz-checksum-sha256': sha256})
+    assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path)
+
+    os.remove(path)
+    mock_server.add_file('/PRODUCTS.csv', CONTENT, headers={'ETag': f'"{hashlib.md5(CONTENT).hexdigest()}"'})
+    assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path)
+
+    os.remove(path)
+    mock_server.add_file('/PRODUCTS.csv', CONTENT, headers={'ETag': f'"{hashlib.md5(b"other").hexdigest()}"'})
+    assert not downloader.download(f'{mock_server.url}PRODUCTS.csv', path)
+    assert os.listdir(tmp_path) == []
+
+def test_progress_is_not_redrawn_on_every_chunk(mock_server, tmp_path, capsys):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    Downloader(segments=2, min_segment_size=1000, chunk_size=64, progress_interval=60).download(
+        f'{mock_server.url}PRODUCTS.csv', path
+    )
+    assert capsys.readouterr().out.count('\r[') == 2
+
+def test_sink_gets_the_file_in_order(mock_server, tmp_path):
+    mock_server.add_file('/PRODUCTS.csv', CONTENT)
+    path = str(tmp_path.joinpath('PRODUCTS.csv'))
+    manifest = AssetManifest(str(tmp_path.joinpath('.manifest.json')))
+    downloader = Downloader(segments=4, min_segment_size=1000, chunk_size=128)
+    for _ in range(2):
+        # downloaded, then read from disk as it did not change.
+        received = []
+        assert downloader.download(f'{mock_server.url}PRODUCTS.csv', path, manifest, received.append)
+        assert b''.join(received) == CONTENT
+
+def _rows(count):
+    stock = ''.join(f'{n}|{"MM" if n % 3 else "MORPHEUS"}|{n}.5|{n % 4}\n' for n in range(count))
+    products = ''.join(f'{n}|item {n}\n' for n in range(count))
+    return ('SKU|BRANCH|PRICE|STOCK\n' + stock).encode(), ('SKU|ITEM_NAME\n' + products).encode()
+
+def test_csvs_are_parsed_while_downloaded(mock_server, tmp_path):
+    stock, products = _rows(5000)
+    mock_server.add_file('/PRICES-STOCK.csv', stock)
+    mock_server.add_file('/PRODUCTS.csv', products)
+    paths = {name: str(tmp_path.joinpath(name)) for name in ('PRICES-STOCK.csv', 'PRODUCTS.csv')}
+    pipes = {path: StreamPipe(max_buffered=1 << 16) for path in paths.values()}
+
+    def download(name):
+        path = paths[name]
+        completed = Downloader(segments=3, min_segment_size=4096, chunk_size=1024).download(
+            f'{mock_server.url}{name}', path, sink=pipes[path].write
+        )
+        pipes[path].finish(None if completed else IOError(name))
+    threads = [threading.Thread(target=download, args=(name,)) for name in paths]
+    for thread in threads:
+        thread.start()
+
+    kwargs = dict(products_csv=paths['PRODUCTS.csv'], price_stock_csv=paths['PRICES-STOCK.csv'], merchant_id='m', chunksize=500)
+    filters = dict(branch_column='BRANCH', branches=['MM'], stock_column='STOCK', sku_column='SKU')
+    streamed = CSVOps(PandasOperations(), **kwargs)
+    streamed.stream_filtered(sources=pipes, **filters)
+    for thread in threads:
+        thread.join()
+    from_disk = CSVOps(PandasOperations(), **kwargs)
+    from_disk.stream_filtered(**filters)
+    pd.testing.assert_frame_equal(streamed.stock, from_disk.stock)
+    pd.testing.assert_frame_equal(streamed.products, from_disk.products)
+    assert len(streamed.products) == len(streamed.stock) > 0
+
+def test_open_streams_parses_products_from_disk(mock_server, tmp_path, monkeypatch):
+    stock, products = _rows(5000)
+    mock_server.add_file('/PRICES-STOCK.csv', stock)
+    mock_server.add_file('/PRODUCTS.csv', products)
+    monkeypatch.setattr(IntegrationSetup, 'PARENT_DIR', tmp_path)
+    monkeypatch.setattr(IntegrationSetup, '_IntegrationSetup__CSVs_URL', {
+        'products': f'{mock_server.url}PRODUCTS.csv',
+        'prices_stock': f'{mock_server.url}PRICES-STOCK.csv',
+    })
+    setup = IntegrationSetup()
+    pipes = setup.open_streams(segments=2)
+    kwargs = dict(products_csv=setup.products_csv_path, price_stock_csv=setup.prices_stock_csv_path, merchant_id='m', chunksize=500)
+    filters = dict(branch_column='BRANCH', branches=['MM'], stock_column='STOCK', sku_column='SKU')
+    streamed = CSVOps(PandasOperations(), **kwargs)
+    streamed.stream_filtered(sources=pipes, **filters)
+    assert open(setup.products_csv_path, 'rb').read() == products
+    from_disk = CSVOps(PandasOperations(), **kwargs)
+    from_disk.stream_filtered(**filters)
+    pd.testing.assert_frame_equal(streamed.stock, from_disk.stock)
+    pd.testing.assert_frame_equal(streamed.products, from_disk.products)
+
+def test_failed_download_stops_parsing():
+    pipe = StreamPipe()
+    pipe.write(b'SKU|ITEM_NAME\n1|a\n')
+    pipe.finish(IOError('PRODUCTS.csv'))
+    with pytest.raises(IOError):
+        pd.read_csv(pipe, sep='|')
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from src.cornershop.utils import IngestItem, validate_ingest_items
+
+COLUMNS = {
+    'sku': 'SKU', 'barcodes': 'EAN', 'brand': 'BRAND_NAME', 'name': 'ITEM_NAME',
+    'description': 'ITEM_DESCRIPTION', 'package': 'PACKAGE', 'image_url': 'ITEM_IMG',
+    'category': 'CATEGORY_STREAM', 'url': 'ITEM_IMG', 'branch': 'BRANCH',
+    'price': 'PRICE', 'stock': 'STOCK'
+}
+MOCK_ITEMS = pd.DataFrame({
+    'SKU': [1, 2, 3],
+    'EAN': ['750', np.nan, '751'],
+    'BRAND_NAME': ['A', 'B', 'C'],
+    'ITEM_NAME': ['a', 'b', 'c'],
+    'ITEM_DESCRIPTION': ['d', 'e', np.nan],
+    'PACKAGE': ['1 KG', '', ''],
+    'ITEM_IMG': ['http://img/1', 'http://img/2', 'http://img/3'],
+    'CATEGORY_STREAM': ['x|y|z', 'x|y|z', 'x|y|z'],
+    'BRANCH': pd.Categorical(['MM', 'RHSM', 'MM']),
+    'PRICE': [10.5, 20.0, 30.0],
+    'STOCK': [1, 2, 3],
+})
+
+
+def test_bulk_validation_matches_ingest_item():
+    items, rejected = validate_ingest_items(MOCK_ITEMS, merchant_id='m', columns=COLUMNS)
+    expected = IngestItem(
+        merchant_id='m', sku='1', barcodes=['750'], brand='A', name='a', description='d',
+        package='1 KG', image_url='http://img/1', category='x|y|z', url='http://img/1',
+        branch_products=[{'branch': 'MM', 'price': 10.5, 'stock': 1}]
+    )
+    assert items == [expected.__dict__]
+
+def test_bulk_validation_reports_rejected_rows():
+    _, rejected = validate_ingest_items(MOCK_ITEMS, merchant_id='m', columns=COLUMNS)
+    assert rejected['SKU'].tolist() == [2, 3]
+    assert rejected['reason'].tolist() == ['barcodes', 'description']
+
+def test_bulk_validation_rejects_missing_brand():
+    dataframe = MOCK_ITEMS.assign(BRAND_NAME=[np.nan, 'B', 'C'])
+    items, rejected = validate_ingest_items(dataframe, merchant_id='m', columns=COLUMNS)
+    assert items == []
+    assert rejected['reason'].tolist() == ['brand', 'barcodes', 'description']
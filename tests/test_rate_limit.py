@@ -0,0 +1,68 @@
+import logging
+import time
+
+from src.cornershop.utils import ProductSender, RateLimiter, api_factory
+from src.cornershop.utils.api import API, APIOps
+
+
+def test_bucket_allows_burst_then_paces():
+    limiter = RateLimiter(10, burst=3)
+    waits = [limiter.reserve() for _ in range(5)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert 0.05 < waits[3] < waits[4] <= 0.2
+
+def test_throttling_pauses_and_slows_down():
+    limiter = RateLimiter(100, burst=10)
+    limiter.update(429, {'Retry-After': '0.3'})
+    assert limiter.rate == 50
+    assert 0.2 < limiter.reserve() <= 0.3
+    for _ in range(100):
+        limiter.update(200, {})
+    assert limiter.rate == 100
+
+def test_concurrent_throttling_halves_the_rate_once():
+    limiter = RateLimiter(100, burst=10)
+    issued_at = time.monotonic()
+    for _ in range(8):
+        limiter.update(429, {'Retry-After': '0'}, issued_at=issued_at)
+    assert limiter.rate == 50
+    limiter.update(429, {'Retry-After': '0'})
+    assert limiter.rate == 25
+
+def test_rate_follows_rate_limit_headers():
+    limiter = RateLimiter(100)
+    limiter.update(200, {'X-RateLimit-Remaining': '20', 'X-RateLimit-Reset': '10'})
+    assert limiter.rate == RateLimiter.HEADROOM * 2
+    limiter.update(200, {'RateLimit-Remaining': '0', 'RateLimit-Reset': '0.5'})
+    assert limiter.reserve() > 0.4
+
+def test_rate_is_restored_when_the_window_resets():
+    limiter = RateLimiter(100, burst=10)
+    limiter.update(200, {'RateLimit-Remaining': '0', 'RateLimit-Reset': '0.2'})
+    assert limiter.rate == 100
+    # reserved during the pause, at the full rate once it is over.
+    assert max(limiter.reserve() for _ in range(5)) < 0.3
+    limiter.update(200, {'RateLimit-Remaining': '1', 'RateLimit-Reset': '0.2'})
+    assert limiter.rate < 10
+    time.sleep(0.25)
+    limiter.reserve()
+    assert limiter.rate == 100
+
+def test_async_sender_is_paced(mock_server, credentials_file):
+    limiter = RateLimiter(40, burst=2)
+    api = API(api=APIOps(credentials_file, mock_server.url, rate_limiter=limiter), logger=logging.getLogger('test'))
+    started = time.monotonic()
+    assert api.send_products_async(({'sku': str(n)} for n in range(20)), concurrency=8)['ingested'] == 20
+    assert time.monotonic() - started >= 18 / 40
+
+def test_worker_processes_share_limiter(mock_server, credentials_file):
+    APIOps(credentials_file, mock_server.url)
+    limiter = RateLimiter(40, burst=2)
+    factory = api_factory(
+        credentials_file, mock_server.url, timeout=(5.0, 30.0), logger_name='test', rate_limiter=limiter
+    )
+    with ProductSender('processes', 3, factory) as sender:
+        sender.send([{'sku': 'warm-up'}] * 3)
+        started = time.monotonic()
+        assert sender.send({'sku': str(n)} for n in range(20))['ingested'] == 20
+    assert time.monotonic() - started >= 18 / 40